@@ -0,0 +1,57 @@
+"""Фоновые задачи в пулах потоков процесса.
+
+Задачи живут только в памяти процесса: то, что нельзя потерять при
+перезапуске, должно уметь догоняться (повтор, команда manage.py).
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def _get_executor(name, workers):
+    with _executors_lock:
+        executor = _executors.get(name)
+        if executor is None:
+            executor = _executors[name] = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix=name,
+            )
+        return executor
+
+
+def _run(name, func, args):
+    try:
+        func(*args)
+    except Exception:
+        logger.exception(
+            'Фоновая задача %s не выполнена: %s%r',
+            name, func.__qualname__, args,
+        )
+
+
+def _run_in_worker(name, func, args):
+    try:
+        _run(name, func, args)
+    finally:
+        connection.close()
+
+
+def submit(name, workers_setting, func, *args):
+    """Выполняет func(*args) в пуле потоков name.
+
+    Размер пула задаёт настройка workers_setting; при 0 задача
+    выполняется сразу в текущем потоке. Ошибка задачи пишется в лог, а
+    соединение с базой потока пула после задачи закрывается.
+    """
+    workers = getattr(settings, workers_setting)
+    if not workers:
+        _run(name, func, args)
+        return
+    _get_executor(name, workers).submit(_run_in_worker, name, func, args)
@@ -0,0 +1,400 @@
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import pickle
+import random
+import struct
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.locmem import LocMemCache
+
+# Значение, сохранённое через get_or_set: кроме самого значения хранит
+# время его вычисления и момент истечения для раннего пересчёта.
+Entry = namedtuple('Entry', 'value delta expiry')
+
+
+# Отображения файлов MmapCache и замки потоков — общие для процесса.
+# Экземпляр кэша у каждого потока свой, а блокировки fcntl принадлежат
+# процессу и потоки друг от друга не защищают.
+_mappings = {}
+_file_locks = {}
+_registry_lock = threading.Lock()
+
+
+def _unwrap(value):
+    return value.value if type(value) is Entry else value
+
+
+def _get_mapping(path, size):
+    """Дескриптор, отображение и замок потоков для файла в процессе."""
+    pid = os.getpid()
+    with _registry_lock:
+        lock = _file_locks.setdefault((path, pid), threading.Lock())
+        key = (path, size, pid)
+        if key not in _mappings:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            _mappings[key] = (fd, mmap.mmap(fd, size))
+        fd, mapping = _mappings[key]
+    return fd, mapping, lock
+
+
+class TieredCache(BaseCache):
+    """Двухуровневый кэш: L1 в памяти процесса перед общим L2.
+
+    L2 — другой кэш из CACHES (OPTIONS['L2']), общий для всех воркеров.
+    Прочитанное из L2 держится в L1 не дольше L1_TIMEOUT секунд: столько
+    другой процесс может видеть старое значение после записи.
+
+    get_or_set() защищает от «набега» на истёкший ключ: вычисляет
+    значение только тот, кто взял блокировку в L2, остальные ждут его
+    результат; незадолго до истечения значение вероятностно пересчитывается
+    заранее (XFetch), пока остальные продолжают читать старое.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._l2_alias = options['L2']
+        self._l1 = LocMemCache(f'tiered-l1:{location}', {
+            'TIMEOUT': options.get('L1_TIMEOUT', 1),
+            'OPTIONS': {'MAX_ENTRIES': options.get('L1_MAX_ENTRIES', 1000)},
+        })
+        self.lock_timeout = options.get('LOCK_TIMEOUT', 10)
+        self.lock_poll = options.get('LOCK_POLL', 0.05)
+        self.beta = options.get('XFETCH_BETA', 1.0)
+
+    @property
+    def l2(self):
+        return caches[self._l2_alias]
+
+    def _timeout(self, timeout):
+        return self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+
+    def _l1_key(self, key, version):
+        return self.l2.make_key(key, version=version)
+
+    def _l1_set(self, key, value, version):
+        timeout = DEFAULT_TIMEOUT
+        if type(value) is Entry:
+            timeout = min(self._l1.default_timeout, value.expiry - time.time())
+            if timeout <= 0:
+                return
+        self._l1.set(self._l1_key(key, version), value, timeout)
+
+    def _raw_get(self, key, version):
+        l1_key = self._l1_key(key, version)
+        value = self._l1.get(l1_key)
+        if value is None:
+            value = self.l2.get(key, version=version)
+            if value is not None:
+                self._l1_set(key, value, version)
+        return value
+
+    def get(self, key, default=None, version=None):
+        value = self._raw_get(key, version)
+        return default if value is None else _unwrap(value)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.l2.set(key, value, self._timeout(timeout), version=version)
+        self._l1_set(key, value, version)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.l2.add(
+            key, value, self._timeout(timeout), version=version
+        )
+        self._l1.delete(self._l1_key(key, version))
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.l2.touch(key, self._timeout(timeout), version=version)
+
+    def delete(self, key, version=None):
+        self._l1.delete(self._l1_key(key, version))
+        self.l2.delete(key, version=version)
+
+    def has_key(self, key, version=None):
+        return self._raw_get(key, version) is not None
+
+    def incr(self, key, delta=1, version=None):
+        self._l1.delete(self._l1_key(key, version))
+        return self.l2.incr(key, delta, version=version)
+
+    def get_many(self, keys, version=None):
+        found = {}
+        missing = []
+        for key in keys:
+            value = self._l1.get(self._l1_key(key, version))
+            if value is None:
+                missing.append(key)
+            else:
+                found[key] = value
+        if missing:
+            for key, value in self.l2.get_many(
+                missing, version=version
+            ).items():
+                self._l1_set(key, value, version)
+                found[key] = value
+        return {key: _unwrap(value) for key, value in found.items()}
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.l2.set_many(
+            data, self._timeout(timeout), version=version
+        )
+        for key, value in data.items():
+            self._l1_set(key, value, version)
+        return failed
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self._l1.delete(self._l1_key(key, version))
+        self.l2.delete_many(keys, version=version)
+
+    def clear(self):
+        self._l1.clear()
+        self.l2.clear()
+
+    def _lock_key(self, key):
+        return f'lock:{key}'
+
+    def _compute(self, key, default, timeout, version):
+        start = time.time()
+        value = default() if callable(default) else default
+        if value is None:
+            return None
+        timeout = self._timeout(timeout)
+        expiry = math.inf if timeout is None else time.time() + timeout
+        entry = Entry(value, time.time() - start, expiry)
+        self.set(key, entry, timeout, version=version)
+        return value
+
+    def _should_refresh(self, entry):
+        # XFetch: чем дольше вычисление и ближе истечение, тем вероятнее
+        # пересчитать значение заранее.
+        jitter = -entry.delta * self.beta * math.log(random.random() or 1e-12)
+        return time.time() + jitter >= entry.expiry
+
+    def get_or_set(self, key, default, timeout=DEFAULT_TIMEOUT, version=None):
+        """Значение из кэша или вычисленное ровно одним процессом.
+
+        Если ``default`` вернул None, в кэш ничего не пишется.
+        """
+        lock = self._lock_key(key)
+        value = self._raw_get(key, version)
+        if value is not None:
+            if type(value) is not Entry or not self._should_refresh(value):
+                return _unwrap(value)
+            if not self.l2.add(lock, 1, self.lock_timeout, version=version):
+                return value.value
+        elif not self.l2.add(lock, 1, self.lock_timeout, version=version):
+            deadline = time.monotonic() + self.lock_timeout
+            while time.monotonic() < deadline:
+                time.sleep(self.lock_poll)
+                value = self.l2.get(key, version=version)
+                if value is not None:
+                    return _unwrap(value)
+                if not self.l2.has_key(lock, version=version):
+                    break
+            # Вычислявший не справился: считаем сами.
+            return self._compute(key, default, timeout, version)
+        try:
+            return self._compute(key, default, timeout, version)
+        finally:
+            self.l2.delete(lock, version=version)
+
+
+class MmapCache(BaseCache):
+    """Кэш в файле, отображённом в память, общий для процессов на хосте.
+
+    Файл LOCATION разбит на SLOTS ячеек по SLOT_SIZE байт, собранных в
+    наборы по WAYS ячеек (set-associative): ключ живёт только в своём
+    наборе, а при нехватке места вытесняется давно не читавшаяся ячейка
+    набора. Набор блокируется fcntl на время операции, поэтому чтение,
+    запись и incr атомарны между процессами. Значения, не влезающие в
+    ячейку, не кэшируются.
+    """
+    # Заголовок ячейки: хэш ключа, срок жизни, время последнего чтения,
+    # длина ключа и длина значения.
+    header = struct.Struct('<QddII')
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.path = location
+        self.slot_size = options.get('SLOT_SIZE', 64 * 1024)
+        self.ways = options.get('WAYS', 8)
+        self.sets = max(1, options.get('SLOTS', 1024) // self.ways)
+        self._pid = None
+
+    def _open(self):
+        # После fork у процесса своя блокировка потоков и свой дескриптор.
+        if self._pid == os.getpid():
+            return
+        self._fd, self._map, self._lock = _get_mapping(
+            self.path, self.sets * self.ways * self.slot_size
+        )
+        self._pid = os.getpid()
+
+    @contextmanager
+    def _locked(self, index=None):
+        self._open()
+        if index is None:
+            start = length = 0
+        else:
+            length = self.ways * self.slot_size
+            start = index * length
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, length, start)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, length, start)
+
+    def _locate(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        key = key.encode()
+        digest = hashlib.blake2b(key, digest_size=8).digest()
+        key_hash = int.from_bytes(digest, 'little')
+        return key, key_hash, key_hash % self.sets
+
+    def _slots(self, index):
+        start = index * self.ways * self.slot_size
+        return range(start, start + self.ways * self.slot_size, self.slot_size)
+
+    def _clear_slot(self, offset):
+        self._map[offset:offset + self.header.size] = bytes(self.header.size)
+
+    def _find(self, key, key_hash, index):
+        """Смещение живой ячейки ключа; истёкшая ячейка очищается."""
+        for offset in self._slots(index):
+            slot_hash, expiry, _, key_len, _ = self.header.unpack_from(
+                self._map, offset
+            )
+            start = offset + self.header.size
+            if (
+                slot_hash != key_hash or key_len != len(key)
+                or self._map[start:start + key_len] != key
+            ):
+                continue
+            if expiry <= time.time():
+                self._clear_slot(offset)
+                return None
+            return offset
+        return None
+
+    def _read(self, offset):
+        _, expiry, _, key_len, value_len = self.header.unpack_from(
+            self._map, offset
+        )
+        start = offset + self.header.size + key_len
+        return pickle.loads(self._map[start:start + value_len]), expiry
+
+    def _victim(self, index):
+        """Пустая, истёкшая или давно не читавшаяся ячейка набора."""
+        now = time.time()
+        victim = None
+        oldest = math.inf
+        for offset in self._slots(index):
+            _, expiry, accessed, key_len, _ = self.header.unpack_from(
+                self._map, offset
+            )
+            if not key_len or expiry <= now:
+                return offset
+            if accessed < oldest:
+                victim, oldest = offset, accessed
+        return victim
+
+    def _write(self, key, key_hash, index, value, expiry):
+        offset = self._find(key, key_hash, index)
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if self.header.size + len(key) + len(data) > self.slot_size:
+            if offset is not None:
+                self._clear_slot(offset)
+            return False
+        if offset is None:
+            offset = self._victim(index)
+        start = offset + self.header.size
+        self._map[start:start + len(key)] = key
+        self._map[start + len(key):start + len(key) + len(data)] = data
+        self.header.pack_into(
+            self._map, offset,
+            key_hash, expiry, time.time(), len(key), len(data),
+        )
+        return True
+
+    def _expiry(self, timeout):
+        expiry = self.get_backend_timeout(timeout)
+        return math.inf if expiry is None else expiry
+
+    def get(self, key, default=None, version=None):
+        key, key_hash, index = self._locate(key, version)
+        with self._locked(index):
+            offset = self._find(key, key_hash, index)
+            if offset is None:
+                return default
+            struct.pack_into('<d', self._map, offset + 16, time.time())
+            return self._read(offset)[0]
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key, key_hash, index = self._locate(key, version)
+        with self._locked(index):
+            self._write(key, key_hash, index, value, self._expiry(timeout))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key, key_hash, index = self._locate(key, version)
+        with self._locked(index):
+            if self._find(key, key_hash, index) is not None:
+                return False
+            return self._write(
+                key, key_hash, index, value, self._expiry(timeout)
+            )
+
+    def incr(self, key, delta=1, version=None):
+        name = key
+        key, key_hash, index = self._locate(key, version)
+        with self._locked(index):
+            offset = self._find(key, key_hash, index)
+            if offset is None:
+                raise ValueError(f"Key '{name}' not found")
+            value, expiry = self._read(offset)
+            value += delta
+            self._write(key, key_hash, index, value, expiry)
+        return value
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key, key_hash, index = self._locate(key, version)
+        with self._locked(index):
+            offset = self._find(key, key_hash, index)
+            if offset is None:
+                return False
+            struct.pack_into(
+                '<d', self._map, offset + 8, self._expiry(timeout)
+            )
+            return True
+
+    def delete(self, key, version=None):
+        key, key_hash, index = self._locate(key, version)
+        with self._locked(index):
+            offset = self._find(key, key_hash, index)
+            if offset is not None:
+                self._clear_slot(offset)
+
+    def has_key(self, key, version=None):
+        key, key_hash, index = self._locate(key, version)
+        with self._locked(index):
+            return self._find(key, key_hash, index) is not None
+
+    def clear(self):
+        with self._locked():
+            for index in range(self.sets):
+                for offset in self._slots(index):
+                    self._clear_slot(offset)
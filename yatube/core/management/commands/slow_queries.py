@@ -0,0 +1,67 @@
+import json
+import os
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.slow_queries import normalize
+
+
+class Command(BaseCommand):
+    help = 'Сводка по журналу медленных SQL-запросов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--file', default=settings.SLOW_QUERY_LOG,
+            help='Журнал; ротированные копии .1, .2, ... читаются тоже.',
+        )
+        parser.add_argument(
+            '--top', type=int, default=10,
+            help='Сколько самых дорогих запросов показать.',
+        )
+
+    def read(self, path):
+        paths = [path]
+        index = 1
+        while os.path.exists(f'{path}.{index}'):
+            paths.append(f'{path}.{index}')
+            index += 1
+        for name in paths:
+            if not os.path.exists(name):
+                continue
+            with open(name, encoding='utf-8') as log:
+                for line in log:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+
+    def handle(self, *args, **options):
+        groups = defaultdict(lambda: {
+            'count': 0, 'total': 0.0, 'worst': None, 'views': set(),
+        })
+        for record in self.read(options['file']):
+            group = groups[normalize(record['sql'])]
+            group['count'] += 1
+            group['total'] += record['duration']
+            group['views'].add(record['view'] or '-')
+            if (group['worst'] is None
+                    or record['duration'] > group['worst']['duration']):
+                group['worst'] = record
+        if not groups:
+            self.stdout.write('Медленных запросов не найдено.')
+            return
+        ranked = sorted(
+            groups.items(), key=lambda item: item[1]['total'], reverse=True
+        )
+        for sql, group in ranked[:options['top']]:
+            worst = group['worst']
+            self.stdout.write(self.style.WARNING(
+                f"{group['total']:.3f} с всего, {group['count']} раз, "
+                f"максимум {worst['duration']:.3f} с, "
+                f"view: {', '.join(sorted(group['views']))}"
+            ))
+            self.stdout.write(f'  {sql}')
+            for step in worst['plan']:
+                self.stdout.write(f'    {step}')
@@ -0,0 +1,182 @@
+import bisect
+import threading
+from collections import defaultdict, deque
+
+_local = threading.local()
+
+TIME_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+class RequestStats:
+    """Счётчики одного запроса: SQL и время рендеринга шаблонов."""
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.render_time = 0.0
+
+
+def start_request():
+    _local.stats = RequestStats()
+    return _local.stats
+
+
+def finish_request():
+    _local.stats = None
+
+
+def current():
+    return getattr(_local, 'stats', None)
+
+
+class Histogram:
+    """Гистограмма в формате Prometheus с меткой view."""
+    kind = 'histogram'
+
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counts = defaultdict(lambda: [0] * (len(buckets) + 1))
+        self._sums = defaultdict(float)
+
+    def observe(self, view, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[view][index] += 1
+            self._sums[view] += value
+
+    def samples(self):
+        with self._lock:
+            counts = {view: list(row) for view, row in self._counts.items()}
+            sums = dict(self._sums)
+        for view, row in sorted(counts.items()):
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), row):
+                total += count
+                yield '_bucket', {'view': view, 'le': bound}, total
+            yield '_sum', {'view': view}, sums[view]
+            yield '_count', {'view': view}, total
+
+
+class Summary:
+    """Квантили по скользящему окну последних наблюдений."""
+    kind = 'summary'
+    quantiles = (0.5, 0.9, 0.99)
+
+    def __init__(self, name, description, window=1000):
+        self.name = name
+        self.description = description
+        self._lock = threading.Lock()
+        self._windows = defaultdict(lambda: deque(maxlen=window))
+        self._sums = defaultdict(float)
+        self._counts = defaultdict(int)
+
+    def observe(self, view, value):
+        with self._lock:
+            self._windows[view].append(value)
+            self._sums[view] += value
+            self._counts[view] += 1
+
+    def samples(self):
+        with self._lock:
+            windows = {
+                view: sorted(row) for view, row in self._windows.items()
+            }
+            sums = dict(self._sums)
+            counts = dict(self._counts)
+        for view, values in sorted(windows.items()):
+            for quantile in self.quantiles:
+                index = min(int(quantile * len(values)), len(values) - 1)
+                yield '', {'view': view, 'quantile': quantile}, values[index]
+            yield '_sum', {'view': view}, sums[view]
+            yield '_count', {'view': view}, counts[view]
+
+
+class Gauge:
+    """Текущее значение, которое функция read читает при выдаче."""
+    kind = 'gauge'
+
+    def __init__(self, name, description, read):
+        self.name = name
+        self.description = description
+        self.read = read
+
+    def samples(self):
+        yield '', {}, self.read()
+
+
+DURATION = Summary(
+    'yatube_view_duration_seconds', 'Время обработки запроса view.'
+)
+DURATION_HISTOGRAM = Histogram(
+    'yatube_view_duration_histogram_seconds',
+    'Распределение времени обработки запроса view.',
+    TIME_BUCKETS,
+)
+SQL_QUERIES = Histogram(
+    'yatube_view_sql_queries', 'Число SQL-запросов на запрос.', QUERY_BUCKETS
+)
+SQL_DURATION = Histogram(
+    'yatube_view_sql_duration_seconds',
+    'Суммарное время SQL-запросов на запрос.',
+    TIME_BUCKETS,
+)
+RENDER_DURATION = Histogram(
+    'yatube_view_template_render_seconds',
+    'Время рендеринга шаблонов на запрос.',
+    TIME_BUCKETS,
+)
+RESPONSE_SIZE = Histogram(
+    'yatube_view_response_bytes', 'Размер тела ответа.', SIZE_BUCKETS
+)
+
+METRICS = (
+    DURATION, DURATION_HISTOGRAM, SQL_QUERIES, SQL_DURATION,
+    RENDER_DURATION, RESPONSE_SIZE,
+)
+
+# Метрики приложений, добавленные через register.
+_registered = []
+
+
+def register(metric):
+    """Добавляет метрику приложения в выдачу /metrics."""
+    _registered.append(metric)
+
+
+def record(view, duration, stats, size):
+    DURATION.observe(view, duration)
+    DURATION_HISTOGRAM.observe(view, duration)
+    SQL_QUERIES.observe(view, stats.sql_count)
+    SQL_DURATION.observe(view, stats.sql_time)
+    RENDER_DURATION.observe(view, stats.render_time)
+    if size is not None:
+        RESPONSE_SIZE.observe(view, size)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(key, str(value).replace('"', '\\"'))
+        for key, value in labels.items()
+    ))
+
+
+def render():
+    """Все метрики процесса в текстовом формате Prometheus."""
+    lines = []
+    for metric in (*METRICS, *_registered):
+        lines.append(f'# HELP {metric.name} {metric.description}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for suffix, labels, value in metric.samples():
+            lines.append(
+                f'{metric.name}{suffix}{_format_labels(labels)} {value}'
+            )
+    return '\n'.join(lines) + '\n'
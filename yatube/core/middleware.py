@@ -0,0 +1,104 @@
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from . import metrics, routers
+from .slow_queries import SlowQueryRecorder, get_threshold
+
+
+class MetricsMiddleware:
+    """Собирает по каждому view время ответа, SQL, рендеринг и размер.
+
+    Гистограммы живут в памяти процесса и отдаются view core.metrics.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = metrics.start_request()
+
+        def count_sql(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                stats.sql_count += 1
+                stats.sql_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(count_sql))
+                response = self.get_response(request)
+        finally:
+            metrics.finish_request()
+        duration = time.perf_counter() - start
+        match = request.resolver_match
+        if match is not None:
+            size = None if response.streaming else len(response.content)
+            metrics.record(match.view_name, duration, stats, size)
+        return response
+
+
+class SlowQueryMiddleware:
+    """Пишет в лог медленные SQL-запросы вместе с view и планом."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        threshold = get_threshold()
+        if threshold is None:
+            return self.get_response(request)
+        recorder = SlowQueryRecorder(None, threshold)
+        request.slow_query_recorder = recorder
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        recorder = getattr(request, 'slow_query_recorder', None)
+        if recorder is not None:
+            recorder.view_name = request.resolver_match.view_name
+
+
+class ReplicaRoutingMiddleware:
+    """Включает чтение из реплик для страниц из REPLICA_VIEWS.
+
+    После записи в базу пользователь получает cookie и следующие
+    REPLICA_PIN_SECONDS секунд читает из основной базы, чтобы не увидеть
+    устаревшие данные реплики. Запись определяет роутер, а не метод
+    запроса: подписка, например, выполняется по GET-ссылке.
+    """
+    pin_cookie = 'primary_pin'
+    safe_methods = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        routers.reset_writes()
+        try:
+            response = self.get_response(request)
+        finally:
+            routers.use_replicas(False)
+        if routers.has_written():
+            response.set_cookie(
+                self.pin_cookie,
+                '1',
+                max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True,
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        routers.use_replicas(
+            request.method in self.safe_methods
+            and self.pin_cookie not in request.COOKIES
+            and request.resolver_match.view_name in settings.REPLICA_VIEWS
+        )
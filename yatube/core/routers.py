@@ -0,0 +1,45 @@
+import random
+import threading
+
+from django.conf import settings
+
+_state = threading.local()
+
+
+def use_replicas(enabled=True):
+    """Разрешает (или запрещает) чтение из реплик в текущем потоке."""
+    _state.use_replicas = enabled
+
+
+def reset_writes():
+    """Начинает отслеживать запись в базу в текущем потоке."""
+    _state.wrote = False
+
+
+def has_written():
+    """Была ли запись в базу после reset_writes."""
+    return getattr(_state, 'wrote', False)
+
+
+class ReplicaRouter:
+    """Отправляет чтение в реплики, если его разрешил middleware.
+
+    Запись, миграции и чтение вне страниц из REPLICA_VIEWS всегда идут
+    в основную базу default.
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if replicas and getattr(_state, 'use_replicas', False):
+            return random.choice(replicas)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        _state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
@@ -0,0 +1,67 @@
+import json
+import logging
+import re
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger('yatube.slow_queries')
+
+
+def explain(connection, sql, params):
+    """План выполнения запроса SQLite (EXPLAIN QUERY PLAN) строками."""
+    if connection.vendor != 'sqlite':
+        return []
+    # Отдельный «сырой» курсор: не портит результат исходного запроса
+    # и не проходит через execute_wrapper повторно.
+    cursor = connection.create_cursor()
+    try:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params or ())
+        return [row[-1] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+class SlowQueryRecorder:
+    """execute_wrapper, который пишет в лог запросы дольше порога."""
+
+    def __init__(self, view_name, threshold):
+        self.view_name = view_name
+        self.threshold = threshold
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            if duration >= self.threshold:
+                self.record(sql, params, many, context, duration)
+
+    def record(self, sql, params, many, context, duration):
+        plan = []
+        params = [] if many else [str(param) for param in params or ()]
+        if not many and sql.lstrip().upper().startswith('SELECT'):
+            try:
+                plan = explain(context['connection'], sql, params)
+            except Exception:
+                logger.debug('EXPLAIN failed for %s', sql, exc_info=True)
+        logger.info(json.dumps({
+            'time': time.time(),
+            'view': self.view_name,
+            'duration': duration,
+            'sql': sql,
+            'params': params,
+            'plan': plan,
+        }, ensure_ascii=False))
+
+
+def get_threshold():
+    return getattr(settings, 'SLOW_QUERY_THRESHOLD', None)
+
+
+def normalize(sql):
+    """Приводит запросы с разными литералами к одному виду."""
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+\b', '?', sql)
+    return re.sub(r'\s+', ' ', sql).strip()
@@ -0,0 +1,307 @@
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import connections
+from django.test import (
+    Client, TestCase, TransactionTestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+
+from core import background
+from core.cache_backends import Entry, MmapCache
+from posts.models import Group, Post
+
+User = get_user_model()
+
+
+class MetricsTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='user')
+        Post.objects.create(text='Test', author=cls.user)
+
+    def setUp(self):
+        self.client = Client()
+        cache.clear()
+
+    def test_metrics_by_view(self):
+        self.client.get(f'/profile/{self.user.username}/')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        for line in (
+            'yatube_view_duration_seconds{view="posts:profile",'
+            'quantile="0.99"}',
+            'yatube_view_sql_queries_count{view="posts:profile"}',
+            'yatube_view_template_render_seconds_sum{view="posts:profile"}',
+            'yatube_view_response_bytes_bucket{view="posts:profile",'
+            'le="+Inf"}',
+        ):
+            with self.subTest(line=line):
+                self.assertIn(line, body)
+
+
+class SlowQueryTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='user')
+        Post.objects.create(text='Test', author=cls.user)
+
+    def setUp(self):
+        self.client = Client()
+        cache.clear()
+
+    @override_settings(SLOW_QUERY_THRESHOLD=0)
+    def test_slow_queries_logged_with_plan(self):
+        with self.assertLogs('yatube.slow_queries', 'INFO') as logs:
+            self.client.get(f'/profile/{self.user.username}/')
+        records = [json.loads(line.split(':', 2)[2]) for line in logs.output]
+        feed = [
+            record for record in records
+            if 'FROM "posts_post"' in record['sql']
+        ]
+        self.assertTrue(feed)
+        self.assertEqual(feed[0]['view'], 'posts:profile')
+        self.assertTrue(feed[0]['plan'])
+
+    @override_settings(SLOW_QUERY_THRESHOLD=None)
+    def test_disabled(self):
+        with self.assertRaises(AssertionError):
+            with self.assertLogs('yatube.slow_queries', 'INFO'):
+                self.client.get('/')
+
+    def test_summary_command(self):
+        record = {
+            'view': 'posts:index', 'duration': 0.5, 'params': [],
+            'sql': 'SELECT * FROM posts_post WHERE id = 1',
+            'plan': ['SCAN posts_post'],
+        }
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'slow.log')
+            with open(path, 'w') as log:
+                log.write(json.dumps(record) + '\n')
+                record['sql'] = 'SELECT * FROM posts_post WHERE id = 2'
+                log.write(json.dumps(record) + '\n')
+            out = StringIO()
+            call_command('slow_queries', file=path, stdout=out)
+        self.assertIn('2 раз', out.getvalue())
+        self.assertIn('SELECT * FROM posts_post WHERE id = ?', out.getvalue())
+        self.assertIn('SCAN posts_post', out.getvalue())
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='user')
+        self.group = Group.objects.create(
+            title='Группа', slug='test-slug', description='Описание'
+        )
+        Post.objects.create(text='Test', author=self.user, group=self.group)
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def replica_queries(self, url):
+        with CaptureQueriesContext(connections['replica']) as queries:
+            self.client.get(url)
+        return len(queries)
+
+    def test_feed_reads_go_to_replica(self):
+        self.assertGreater(self.replica_queries('/group/test-slug/'), 0)
+
+    def test_other_views_read_from_default(self):
+        self.assertEqual(self.replica_queries('/create/'), 0)
+
+    def test_reads_pinned_to_default_after_write(self):
+        response = self.client.post('/create/', {'text': 'Новый пост'})
+        self.assertIn('primary_pin', response.cookies)
+        self.assertEqual(self.replica_queries('/group/test-slug/'), 0)
+
+    def test_write_on_get_pins_reads(self):
+        User.objects.create_user(username='author')
+        response = self.client.get('/group/test-slug/')
+        self.assertNotIn('primary_pin', response.cookies)
+        response = self.client.get('/profile/author/follow/')
+        self.assertIn('primary_pin', response.cookies)
+        self.assertEqual(self.replica_queries('/follow/'), 0)
+
+
+class TieredCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.l2 = caches['shared']
+
+    def test_l1_in_front_of_l2(self):
+        cache.set('key', 'value')
+        self.assertEqual(self.l2.get('key'), 'value')
+        # Пока запись жива в L1, L2 не читается.
+        self.l2.set('key', 'other')
+        self.assertEqual(cache.get('key'), 'value')
+        cache.delete('key')
+        self.assertIsNone(self.l2.get('key'))
+        self.assertIsNone(cache.get('key'))
+        self.l2.set('key', 'shared')
+        self.assertEqual(cache.get('key'), 'shared')
+
+    def test_incr_goes_to_l2(self):
+        cache.set('counter', 1)
+        self.assertEqual(cache.incr('counter'), 2)
+        self.assertEqual(cache.get('counter'), 2)
+
+    def test_get_or_set_single_flight(self):
+        calls = []
+        results = []
+        barrier = threading.Barrier(5)
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'page'
+
+        def worker():
+            barrier.wait()
+            results.append(cache.get_or_set('hot', compute, 60))
+
+        threads = [threading.Thread(target=worker) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['page'] * 5)
+        self.assertEqual(cache.get('hot'), 'page')
+
+    def test_get_or_set_none_is_not_cached(self):
+        self.assertIsNone(cache.get_or_set('key', lambda: None, 60))
+        self.assertIsNone(self.l2.get('key'))
+
+    def test_early_recomputation(self):
+        # Вычисление дольше оставшегося времени жизни: пересчитываем.
+        self.l2.set('key', Entry('old', 100, time.time() + 1))
+        self.assertEqual(cache.get_or_set('key', lambda: 'new', 60), 'new')
+        cache.delete('key')
+        self.l2.set('key', Entry('old', 0.001, time.time() + 60))
+        self.assertEqual(cache.get_or_set('key', lambda: 'new', 60), 'old')
+
+
+def _incr_many(path, options, times):
+    backend = MmapCache(path, {'OPTIONS': options})
+    for _ in range(times):
+        backend.incr('counter')
+
+
+class MmapCacheTests(TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+        self.addCleanup(os.remove, self.path)
+        self.cache = self.make_cache()
+
+    def make_cache(self, **options):
+        self.options = {'SLOTS': 4, 'WAYS': 2, 'SLOT_SIZE': 256, **options}
+        return MmapCache(self.path, {'OPTIONS': self.options})
+
+    def test_shared_between_instances(self):
+        self.cache.set('key', {'value': 1})
+        self.assertEqual(self.make_cache().get('key'), {'value': 1})
+        self.make_cache().delete('key')
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_expiry_add_and_touch(self):
+        self.cache.set('key', 'value', 0)
+        self.assertIsNone(self.cache.get('key'))
+        self.assertTrue(self.cache.add('key', 'value', 60))
+        self.assertFalse(self.cache.add('key', 'other', 60))
+        self.assertTrue(self.cache.touch('key', 0))
+        self.assertFalse(self.cache.has_key('key'))
+
+    def test_lru_eviction(self):
+        cache = self.make_cache(SLOTS=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_too_large_value_is_not_cached(self):
+        self.cache.set('key', 'value')
+        self.cache.set('key', 'x' * 1000)
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_incr_is_atomic_between_processes(self):
+        self.cache.set('counter', 0)
+        context = multiprocessing.get_context('fork')
+        workers = [
+            context.Process(
+                target=_incr_many, args=(self.path, self.options, 50)
+            )
+            for _ in range(4)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(self.cache.get('counter'), 200)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+    def test_incr_is_atomic_between_threads(self):
+        # Как и caches[...], у каждого потока свой экземпляр кэша.
+        self.cache.set('counter', 0)
+        # Частое переключение потоков, чтобы гонка проявлялась наверняка.
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        self.addCleanup(sys.setswitchinterval, interval)
+        threads = [
+            threading.Thread(
+                target=_incr_many, args=(self.path, self.options, 2000)
+            )
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.cache.get('counter'), 16000)
+
+
+class BackgroundTests(TestCase):
+
+    @override_settings(TEST_WORKERS=0)
+    def test_inline_error_is_logged(self):
+        with self.assertLogs('core.background', 'ERROR'):
+            background.submit('test', 'TEST_WORKERS', int, 'x')
+
+    @override_settings(TEST_WORKERS=1)
+    def test_runs_in_named_pool(self):
+        done = threading.Event()
+        names = []
+
+        def job(value):
+            names.append((threading.current_thread().name, value))
+            done.set()
+
+        background.submit('test', 'TEST_WORKERS', job, 1)
+        self.assertTrue(done.wait(5))
+        name, value = names[0]
+        self.assertTrue(name.startswith('test'))
+        self.assertEqual(value, 1)
@@ -1,6 +1,7 @@
 from django.contrib import admin
 
 from .models import Group, Post, Comment
+from .search import search_posts
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -10,6 +11,13 @@ class PostAdmin(admin.ModelAdmin):
     empty_value_display = '-пусто-'
     list_editable = ('group',)
 
+    def get_search_results(self, request, queryset, search_term):
+        # Ищем по полнотекстовому индексу вместо LIKE по search_fields.
+        if not search_term:
+            return queryset, False
+        found = search_posts(search_term).values('pk')
+        return queryset.filter(pk__in=found), False
+
 
 class GroupAdmin(admin.ModelAdmin):
     list_display = ('pk', 'title', 'slug', 'descriptions',)
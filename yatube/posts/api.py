@@ -0,0 +1,179 @@
+"""JSON API лент только для чтения.
+
+Посты выбираются без JOIN, а авторы, группы и миниатюры догружаются
+пачками: по одному запросу на тип для всей страницы. Страницы
+листаются курсором; с параметром export лента выгружается целиком
+потоком, пачками по API_EXPORT_BATCH_SIZE постов.
+"""
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+
+from . import follow_graph, thumbnails, timeline
+from .cache import FOLLOWS, INDEX, conditional
+from .models import Group, Post, User
+from .utils import CursorPaginator
+
+# Колонки поста; связанные объекты выбираются отдельными пачками.
+POST_FIELDS = ('text', 'created', 'author', 'group', 'image')
+
+POST_ORDERING = ('-created', '-id')
+
+
+class BatchLoader:
+    """Загрузчик в духе DataLoader: все ключи пачки одним запросом.
+
+    Загруженное запоминается, поэтому при потоковой выгрузке уже
+    встреченные авторы и группы повторно не запрашиваются.
+    """
+
+    def __init__(self, fetch):
+        self.fetch = fetch
+        self.loaded = {}
+
+    def load_many(self, keys):
+        missing = {key for key in keys if key and key not in self.loaded}
+        if missing:
+            found = self.fetch(missing)
+            for key in missing:
+                self.loaded[key] = found.get(key)
+        return [self.loaded.get(key) if key else None for key in keys]
+
+
+def _fetch_authors(ids):
+    authors = User.objects.filter(pk__in=ids).only(
+        'username', 'first_name', 'last_name'
+    )
+    return {
+        author.pk: {
+            'username': author.username,
+            'full_name': author.get_full_name(),
+        }
+        for author in authors
+    }
+
+
+def _fetch_groups(ids):
+    groups = Group.objects.filter(pk__in=ids).only('slug', 'title')
+    return {
+        group.pk: {'slug': group.slug, 'title': group.title}
+        for group in groups
+    }
+
+
+class PostSerializer:
+    """Превращает пачки постов в словари для JSON."""
+
+    def __init__(self, request):
+        self.request = request
+        self.authors = BatchLoader(_fetch_authors)
+        self.groups = BatchLoader(_fetch_groups)
+        self.thumbnails = BatchLoader(thumbnails.get_ready_many)
+
+    def _url(self, url):
+        return self.request.build_absolute_uri(url) if url else None
+
+    def serialize(self, posts):
+        authors = self.authors.load_many([post.author_id for post in posts])
+        groups = self.groups.load_many([post.group_id for post in posts])
+        ready = self.thumbnails.load_many([post.image for post in posts])
+        return [
+            {
+                'id': post.pk,
+                'url': self._url(reverse(
+                    'posts:post_detail', kwargs={'post_id': post.pk}
+                )),
+                'text': post.text,
+                'created': post.created,
+                'author': author,
+                'group': group,
+                'image': self._url(post.image.url if post.image else None),
+                'thumbnail': self._url(thumbnail.url if thumbnail else None),
+            }
+            for post, author, group, thumbnail
+            in zip(posts, authors, groups, ready)
+        ]
+
+
+def _get_limit(request):
+    try:
+        limit = int(request.GET.get('limit', settings.PAGINATOR_CONST))
+    except ValueError:
+        limit = settings.PAGINATOR_CONST
+    return min(max(limit, 1), settings.API_MAX_LIMIT)
+
+
+def _export(serializer, paginator, cursor):
+    yield '{"results": ['
+    separator = ''
+    while True:
+        page = paginator.get_page(cursor)
+        posts = [timeline.as_post(row) for row in page]
+        for item in serializer.serialize(posts):
+            yield separator + json.dumps(item, cls=DjangoJSONEncoder)
+            separator = ','
+        cursor = page.next_cursor
+        if cursor is None:
+            break
+    yield ']}'
+
+
+def feed_response(request, queryset, ordering=POST_ORDERING):
+    """Страница ленты по курсору или потоковая выгрузка (export)."""
+    serializer = PostSerializer(request)
+    cursor = request.GET.get('cursor')
+    if 'export' in request.GET:
+        paginator = CursorPaginator(
+            queryset, settings.API_EXPORT_BATCH_SIZE, ordering
+        )
+        return StreamingHttpResponse(
+            _export(serializer, paginator, cursor),
+            content_type='application/json',
+        )
+    page = CursorPaginator(
+        queryset, _get_limit(request), ordering
+    ).get_page(cursor)
+    return JsonResponse({
+        'results': serializer.serialize(
+            [timeline.as_post(row) for row in page]
+        ),
+        'next_cursor': page.next_cursor,
+        'previous_cursor': page.previous_cursor,
+    })
+
+
+def _posts():
+    return Post.objects.only(*POST_FIELDS)
+
+
+@conditional(INDEX)
+def index(request):
+    return feed_response(request, _posts())
+
+
+@conditional(INDEX)
+def group_posts(request, slug):
+    group = get_object_or_404(Group, slug=slug)
+    return feed_response(request, _posts().filter(group=group))
+
+
+@conditional(INDEX)
+def profile(request, username):
+    author = get_object_or_404(User, username=username)
+    return feed_response(request, _posts().filter(author=author))
+
+
+@conditional(INDEX, FOLLOWS)
+def follow_index(request):
+    user = request.user
+    if not user.is_authenticated:
+        return JsonResponse({'detail': 'Нужна авторизация'}, status=401)
+    return feed_response(
+        request,
+        timeline.get_timeline(user, follow_graph.get_followees(user.pk)),
+        timeline.ORDERING,
+    )
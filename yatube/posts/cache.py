@@ -0,0 +1,454 @@
+import copy
+import hashlib
+import logging
+import time
+from datetime import datetime, timezone
+from functools import partial, wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError
+from django.dispatch import Signal
+from django.views.decorators.http import condition
+
+from core import background
+
+from . import rendering
+
+INDEX = 'index'
+FOLLOWS = 'follows'
+COMMENTS = 'comments'
+# Суррогатный ключ списков постов: меняется, когда пост добавлен,
+# удалён или перенесён в другую группу.
+POSTS = 'posts'
+
+STALE_WARNING = '110 - "Response is Stale"'
+
+# Отправляется после bump: по ключам перерисовываются статические копии.
+versions_bumped = Signal(providing_args=['namespaces'])
+
+logger = logging.getLogger(__name__)
+
+
+def _version_key(namespace):
+    return f'version:{namespace}'
+
+
+def get_version(namespace):
+    """Текущая версия пространства имён кэша."""
+    key = _version_key(namespace)
+    version = cache.get(key)
+    if version is None:
+        # Начальная версия берётся из часов, чтобы после вытеснения
+        # ключа не воскресить страницы, закэшированные до этого.
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def get_versions(namespaces, created=None):
+    """Версии нескольких пространств имён одним обращением к кэшу.
+
+    В множество ``created`` добавляются пространства, версия которых
+    заведена этим вызовом, а не сдвинута bump.
+    """
+    keys = {_version_key(namespace): namespace for namespace in namespaces}
+    found = cache.get_many(keys)
+    versions = {}
+    for key, namespace in keys.items():
+        version = found.get(key)
+        if version is None:
+            version = get_version(namespace)
+            if created is not None:
+                created.add(namespace)
+        versions[namespace] = version
+    return versions
+
+
+def bump(*namespaces):
+    """Инвалидирует всё, что закэшировано под пространствами имён.
+
+    Новая версия — текущее время в наносекундах, так что по версии
+    видно и время последнего изменения.
+    """
+    now = time.time_ns()
+    keys = [_version_key(namespace) for namespace in namespaces]
+    current = cache.get_many(keys)
+    cache.set_many(
+        {key: max(now, (current.get(key) or 0) + 1) for key in keys}, None
+    )
+    versions_bumped.send(sender=None, namespaces=namespaces)
+
+
+def post_tag(pk):
+    return f'post:{pk}'
+
+
+def comments_tag(pk):
+    return f'comments:{pk}'
+
+
+def group_tag(slug):
+    return f'group:{slug}'
+
+
+def author_tag(username):
+    return f'author:{username}'
+
+
+def tag(request, *keys):
+    """Помечает кэшируемую страницу суррогатными ключами."""
+    tags = getattr(request, 'surrogate_keys', None)
+    if tags is not None:
+        tags.update(keys)
+
+
+def _set_surrogate_keys(response, keys):
+    if keys:
+        response['Surrogate-Key'] = ' '.join(sorted(keys))
+
+
+def tag_posts(request, posts):
+    """Ключи постов страницы, их авторов и групп."""
+    for post in posts:
+        tag(request, post_tag(post.pk), author_tag(post.author.username))
+        if post.group_id:
+            tag(request, group_tag(post.group.slug))
+
+
+def conditional(*namespaces):
+    """Условный GET: 304 без вызова view, пока версии не сменились.
+
+    Валидаторы не требуют запросов к базе: ETag строится из версий
+    пространств имён, пользователя, адреса страницы и секрета CSRF
+    (формы на странице несут токен, а после входа секрет меняется),
+    Last-Modified — время последнего изменения в этих пространствах.
+    Устаревшая копия (с заголовком Warning) уходит без валидаторов:
+    иначе клиент подтверждал бы её как свежую до следующего bump.
+    """
+    def etag(request, *args, **kwargs):
+        user_pk = _user_pk(request)
+        if user_pk is None:
+            return None
+        parts = [
+            str(user_pk),
+            request.get_full_path(),
+            request.META.get('CSRF_COOKIE', ''),
+        ]
+        parts += [str(get_version(namespace)) for namespace in namespaces]
+        return hashlib.md5(':'.join(parts).encode()).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        version = max(get_version(namespace) for namespace in namespaces)
+        return datetime.fromtimestamp(version / 10 ** 9, tz=timezone.utc)
+
+    def decorator(view):
+        conditional_view = condition(
+            etag_func=etag, last_modified_func=last_modified
+        )(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            if response.get('Warning') == STALE_WARNING:
+                del response['ETag']
+                del response['Last-Modified']
+            return response
+        return wrapper
+    return decorator
+
+
+def _user_pk(request):
+    """pk пользователя запроса, 0 для анонима; None, если база упала.
+
+    Для вошедшего пользователя это первый запрос к базе: при ошибке
+    страница ещё может уйти из устаревшей копии.
+    """
+    try:
+        return request.user.pk or 0
+    except DatabaseError:
+        logger.exception('Не удалось загрузить пользователя')
+        return None
+
+
+def _path_hash(request):
+    return hashlib.md5(request.get_full_path().encode()).hexdigest()
+
+
+def page_key(request, namespace):
+    version = get_version(namespace)
+    return (
+        f'page:{namespace}:{version}:'
+        f'{request.user.pk or 0}:{_path_hash(request)}'
+    )
+
+
+def stale_key(request, namespace):
+    """Ключ последнего удачного ответа; от версии не зависит.
+
+    Копия привязана к cookie сессии, а не к пользователю: её можно
+    найти, даже когда пользователя не загрузить из базы.
+    """
+    session = request.COOKIES.get(settings.SESSION_COOKIE_NAME, '')
+    session = hashlib.md5(session.encode()).hexdigest()
+    return f'stale:{namespace}:{session}:{_path_hash(request)}'
+
+
+def _refresh_page(render, lock):
+    try:
+        render()
+    finally:
+        cache.delete(lock)
+
+
+def _refresh(key, render):
+    """Один фоновый пересчёт страницы на версию ключа."""
+    lock = f'refresh:{key}'
+    if not cache.add(lock, 1, settings.PAGE_CACHE_REFRESH_TIMEOUT):
+        return
+    background.submit(
+        'page-cache', 'PAGE_CACHE_REFRESH_WORKERS', _refresh_page, render, lock
+    )
+
+
+# Заголовки, без которых фоновый рендер отличался бы от исходного:
+# хост для абсолютных ссылок и секрет CSRF для токенов в формах.
+_REFRESH_META = ('HTTP_HOST', 'CSRF_COOKIE')
+
+
+def _mark_stale(response):
+    response['Warning'] = STALE_WARNING
+    return response
+
+
+class _CachedPage:
+    """Ответ view в кэше: свежая версия и последняя удачная копия."""
+
+    def __init__(self, request, namespace, timeout, render):
+        self.request = request
+        self.namespace = namespace
+        self.key = None
+        self.last_good_key = stale_key(request, namespace)
+        self.timeout = timeout
+        self._render = render
+        self.rendered = None
+
+    def render(self, request=None):
+        """Рендерит страницу; None, если ответ нельзя кэшировать."""
+        request = self.request if request is None else request
+        response = self.rendered = self._render(request)
+        if response.status_code != 200 or response.streaming:
+            return None
+        # Ключи страницы хранятся вместе с ней: при попадании в кэш view
+        # не вызывается и ключей не соберёт.
+        _set_surrogate_keys(
+            response, getattr(request, 'surrogate_keys', None)
+        )
+        cache.set(
+            self.last_good_key,
+            (response, time.time()),
+            settings.PAGE_CACHE_STALE_IF_ERROR,
+        )
+        return response
+
+    def refresh(self, request):
+        response = self.render(request)
+        if response is not None:
+            cache.set(self.key, response, self.timeout)
+
+    def detached_request(self):
+        """Отдельный запрос для рендера в фоновом потоке.
+
+        Исходный запрос ещё обрабатывается: его ленивый user, сессию и
+        surrogate_keys нельзя трогать из другого потока. Копия — тот же
+        адрес, GET и пользователь.
+        """
+        meta = self.request.META
+        request = rendering.build_request(
+            self.request.get_full_path(),
+            copy.copy(self.request.user),
+            secure=self.request.is_secure(),
+            **{key: meta[key] for key in _REFRESH_META if key in meta},
+        )
+        if hasattr(self.request, 'surrogate_keys'):
+            request.surrogate_keys = set()
+        return request
+
+    def _stale_on_error(self, last_good):
+        """Устаревшая копия вместо ошибки базы; None, если её нет."""
+        if last_good is None:
+            return None
+        logger.exception('Ошибка базы, отдаём устаревшую страницу')
+        return _mark_stale(last_good[0])
+
+    def get(self):
+        try:
+            # Ключ страницы требует пользователя, а его загрузка —
+            # первый запрос к базе.
+            self.key = page_key(self.request, self.namespace)
+        except DatabaseError:
+            response = self._stale_on_error(cache.get(self.last_good_key))
+            if response is None:
+                raise
+            return response
+        response = cache.get(self.key)
+        if response is not None:
+            return response
+        last_good = cache.get(self.last_good_key)
+        if last_good is not None:
+            stale, stored = last_good
+            window = settings.PAGE_CACHE_STALE_WHILE_REVALIDATE
+            if time.time() - stored < window:
+                _refresh(
+                    self.key, partial(self.refresh, self.detached_request())
+                )
+                return _mark_stale(stale)
+        try:
+            response = cache.get_or_set(self.key, self.render, self.timeout)
+        except DatabaseError:
+            stale = self._stale_on_error(last_good)
+            if stale is None:
+                raise
+            return stale
+        return self.rendered if response is None else response
+
+
+def cache_page_versioned(timeout, namespace):
+    """Кэширует ответ view до истечения timeout или смены версии.
+
+    В отличие от cache_page, запись перестаёт использоваться сразу
+    после bump(namespace), поэтому timeout можно делать большим.
+    Промах вычисляется через cache.get_or_set: при двухуровневом кэше
+    страницу рендерит один запрос, а не все одновременно пришедшие.
+
+    Последний удачный ответ хранится ещё и без версии. Если рендер упал
+    с ошибкой базы, отдаётся эта копия (с заголовком Warning), если она
+    не старше PAGE_CACHE_STALE_IF_ERROR секунд. В режиме
+    PAGE_CACHE_STALE_WHILE_REVALIDATE копия моложе этого срока
+    отдаётся на промахе сразу, а свежую страницу считает один фоновый
+    поток.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            return _CachedPage(
+                request,
+                namespace,
+                timeout,
+                lambda page_request: view(page_request, *args, **kwargs),
+            ).get()
+        return wrapper
+    return decorator
+
+
+def _anonymous_key(request, versions=None):
+    """Ключ анонимной страницы.
+
+    Без versions — ключ множества суррогатных ключей страницы, с
+    versions — ключ самой страницы при этих версиях её ключей.
+    """
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    if versions is None:
+        return f'anonymous:{path}'
+    state = repr(sorted(versions.items())).encode()
+    return f'anonymous:{path}:{hashlib.md5(state).hexdigest()}'
+
+
+def _cacheable_versions(response, tags, started):
+    """Версии ключей страницы; None, если её нельзя кэшировать.
+
+    Версия — время bump, поэтому версия новее начала рендера значит,
+    что страница могла собраться из данных до изменения.
+    """
+    if (not tags or response.status_code != 200 or response.streaming
+            or response.get('Warning') == STALE_WARNING):
+        return None
+    created = set()
+    versions = get_versions(tags, created)
+    if any(
+        version > started
+        for namespace, version in versions.items()
+        if namespace not in created
+    ):
+        return None
+    return versions
+
+
+class _AnonymousPage:
+    """Анонимная страница в кэше под ключом из версий её ключей.
+
+    Под _anonymous_key(request) лежит множество суррогатных ключей с
+    прошлого рендера, сама страница — под ключом из их текущих версий.
+    После bump все посетители приходят за одним новым ключом, и
+    cache.get_or_set даёт рендерить страницу только одному из них.
+    """
+
+    def __init__(self, request, timeout, render):
+        self.request = request
+        self.timeout = timeout
+        self._render = render
+        self.tags_key = _anonymous_key(request)
+        tags = cache.get(self.tags_key)
+        self.versions = get_versions(tags) if tags else {}
+        self.rendered = None
+
+    def render(self):
+        """Рендерит страницу; None, если её нельзя кэшировать."""
+        request = self.request
+        request.surrogate_keys = set()
+        started = time.time_ns()
+        response = self.rendered = self._render()
+        tags = request.surrogate_keys
+        tags.update(response.get('Surrogate-Key', '').split())
+        _set_surrogate_keys(response, tags)
+        versions = _cacheable_versions(response, tags, started)
+        if versions is None:
+            return None
+        entry = (response, versions)
+        cache.set(self.tags_key, frozenset(versions), self.timeout)
+        if versions != self.versions:
+            # Ключи страницы сменились или ещё не были известны:
+            # следующие запросы придут за ключом новых версий.
+            cache.set(_anonymous_key(request, versions), entry, self.timeout)
+        return entry
+
+    def get(self):
+        entry = cache.get_or_set(
+            _anonymous_key(self.request, self.versions),
+            self.render,
+            self.timeout,
+        )
+        if entry is None:
+            return self.rendered
+        response, versions = entry
+        if (self.rendered is not None
+                or versions.keys() == self.versions.keys()
+                or get_versions(versions) == versions):
+            return response
+        # Страница собрана с другим набором ключей, и они сдвинулись.
+        self.render()
+        return self.rendered
+
+
+def cache_anonymous_page(timeout):
+    """Полностраничный кэш для анонимных посетителей.
+
+    View помечает страницу суррогатными ключами (tag, tag_posts), в
+    кэше вместе с ответом хранятся их версии. bump ключа делает
+    устаревшими ровно те страницы, что им помечены: страница отдаётся
+    из кэша, только пока версии всех её ключей не изменились. Ключи
+    уходят и в заголовке Surrogate-Key — для кэширующего прокси.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if (request.method not in ('GET', 'HEAD')
+                    or _user_pk(request) != 0):
+                return view(request, *args, **kwargs)
+            return _AnonymousPage(
+                request, timeout, lambda: view(request, *args, **kwargs)
+            ).get()
+        return wrapper
+    return decorator
@@ -0,0 +1,111 @@
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Comment, Counter, Follow, Post
+
+ALL_POSTS = 'all_posts'
+AUTHOR_POSTS = 'author_posts'
+GROUP_POSTS = 'group_posts'
+FOLLOWERS = 'followers'
+FOLLOWING = 'following'
+
+# Источник истины для каждого вида счётчика: (queryset, поле группировки).
+SOURCES = {
+    ALL_POSTS: (lambda: Post.objects.all(), None),
+    AUTHOR_POSTS: (lambda: Post.objects.all(), 'author_id'),
+    GROUP_POSTS: (lambda: Post.objects.exclude(group=None), 'group_id'),
+    FOLLOWERS: (lambda: Follow.objects.all(), 'author_id'),
+    FOLLOWING: (lambda: Follow.objects.all(), 'user_id'),
+}
+
+
+def make_key(kind, pk=None):
+    return kind if pk is None else f'{kind}:{pk}'
+
+
+def compute(key):
+    """Считает значение счётчика по исходным таблицам."""
+    kind, _, pk = key.partition(':')
+    queryset, field = SOURCES[kind]
+    queryset = queryset()
+    if field is not None:
+        queryset = queryset.filter(**{field: pk})
+    return queryset.count()
+
+
+def get_many(keys):
+    """Значения счётчиков одним запросом, в порядке ключей.
+
+    Недостающие счётчики досчитываются по исходным таблицам.
+    """
+    values = dict(
+        Counter.objects.filter(key__in=keys).values_list('key', 'value')
+    )
+    for key in keys:
+        if key not in values:
+            counter, _ = Counter.objects.get_or_create(
+                key=key, defaults={'value': compute(key)}
+            )
+            values[key] = counter.value
+    return {key: values[key] for key in keys}
+
+
+def get(kind, pk=None):
+    key = make_key(kind, pk)
+    return get_many([key])[key]
+
+
+def incr(kind, pk=None, delta=1):
+    """Сдвигает счётчик; ещё не созданный счётчик считается заново."""
+    key = make_key(kind, pk)
+    updated = Counter.objects.filter(key=key).update(
+        value=F('value') + delta
+    )
+    if not updated:
+        Counter.objects.get_or_create(
+            key=key, defaults={'value': compute(key)}
+        )
+
+
+def top(kind, limit):
+    """pk объектов с наибольшими счётчиками вида kind."""
+    prefix = f'{kind}:'
+    # Диапазон по первичному ключу вместо LIKE: читается по индексу.
+    keys = Counter.objects.filter(
+        key__gt=prefix, key__lt=f'{kind};'
+    ).order_by('-value').values_list('key', flat=True)[:limit]
+    return [int(key[len(prefix):]) for key in keys]
+
+
+def drop(kind, pk=None):
+    Counter.objects.filter(key=make_key(kind, pk)).delete()
+
+
+def recount():
+    """Пересчитывает все счётчики с нуля; возвращает их число."""
+    counters = []
+    for kind, (queryset, field) in SOURCES.items():
+        if field is None:
+            counters.append(Counter(key=kind, value=queryset().count()))
+            continue
+        rows = queryset().order_by().values(field).annotate(
+            total=Count('pk')
+        ).values_list(field, 'total')
+        counters.extend(
+            Counter(key=make_key(kind, pk), value=total)
+            for pk, total in rows
+        )
+    with transaction.atomic():
+        Counter.objects.all().delete()
+        Counter.objects.bulk_create(counters)
+        recount_comments()
+    return len(counters)
+
+
+def recount_comments():
+    """Пересчитывает Post.comment_count одним UPDATE."""
+    comments = Comment.objects.filter(post=OuterRef('pk')).order_by().values(
+        'post'
+    ).annotate(total=Count('pk')).values('total')
+    Post.objects.update(comment_count=Coalesce(Subquery(comments), 0))
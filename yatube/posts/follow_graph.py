@@ -0,0 +1,174 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, connections, router, transaction
+
+from . import cache as page_cache, counters, timeline
+from .models import Follow, User
+
+
+def _key(user_id):
+    return f'followees:{user_id}'
+
+
+def get_followees(user_id):
+    """Множество id авторов, на которых подписан пользователь."""
+    key = _key(user_id)
+    followees = cache.get(key)
+    if followees is None:
+        followees = frozenset(
+            Follow.objects.filter(
+                user_id=user_id
+            ).values_list('author_id', flat=True)
+        )
+        cache.set(key, followees, settings.FOLLOW_GRAPH_TIMEOUT)
+    return followees
+
+
+def is_following(user_id, author_id):
+    """Подписан ли пользователь на автора."""
+    return author_id in get_followees(user_id)
+
+
+def _invalidate(user_id):
+    """Сбрасывает множество подписок; оно перечитается одним запросом.
+
+    Множество не правится на месте: другой процесс мог прочитать
+    копию из L1 и записать её обратно, потеряв изменение. Ключ
+    удаляется ещё раз после коммита, чтобы не осталось множества,
+    прочитанного из базы до него.
+    """
+    key = _key(user_id)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def _bump_profiles(user_id, author_ids):
+    usernames = User.objects.filter(
+        pk__in=[user_id, *author_ids]
+    ).values_list('username', flat=True)
+    page_cache.bump(
+        page_cache.FOLLOWS,
+        *(page_cache.author_tag(username) for username in usernames)
+    )
+
+
+def followed(user_id, author_ids):
+    """Побочные эффекты новых подписок: граф, лента и счётчики."""
+    _invalidate(user_id)
+    timeline.backfill(user_id, author_ids)
+    for author_id in author_ids:
+        counters.incr(counters.FOLLOWERS, author_id)
+    counters.incr(counters.FOLLOWING, user_id, len(author_ids))
+    timeline.rebalance(author_ids)
+    _bump_profiles(user_id, author_ids)
+
+
+def unfollowed(user_id, author_ids):
+    """Побочные эффекты отписок: граф, лента и счётчики."""
+    _invalidate(user_id)
+    timeline.trim(user_id, author_ids)
+    for author_id in author_ids:
+        counters.incr(counters.FOLLOWERS, author_id, -1)
+    counters.incr(counters.FOLLOWING, user_id, -len(author_ids))
+    timeline.rebalance(author_ids)
+    _bump_profiles(user_id, author_ids)
+
+
+def follow(user_id, author_id):
+    """Подписывает одним INSERT; False, если подписка уже была."""
+    try:
+        with transaction.atomic():
+            Follow.objects.create(user_id=user_id, author_id=author_id)
+    except IntegrityError:
+        return False
+    return True
+
+
+def _delete_rows(user_id, author_ids):
+    """Удаляет подписки одним DELETE; возвращает число строк.
+
+    QuerySet.delete() сначала выбирает строки для сигнала post_delete,
+    а follow_deleted повторил бы побочные эффекты, которые вызывающий
+    выполняет сам и пачкой. На Follow не ссылаются другие модели,
+    поэтому каскадов нет.
+    """
+    connection = connections[router.db_for_write(Follow)]
+    quote = connection.ops.quote_name
+    opts = Follow._meta
+    placeholders = ', '.join(['%s'] * len(author_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {quote(opts.db_table)} '
+            f'WHERE {quote(opts.get_field("user").column)} = %s '
+            f'AND {quote(opts.get_field("author").column)} '
+            f'IN ({placeholders})',
+            [user_id, *author_ids],
+        )
+        return cursor.rowcount
+
+
+def unfollow(user_id, author_id):
+    """Отписывает одним DELETE; False, если подписки не было."""
+    deleted = _delete_rows(user_id, [author_id])
+    if deleted:
+        unfollowed(user_id, [author_id])
+    return bool(deleted)
+
+
+def _batches(ids):
+    ids = sorted(ids)
+    size = settings.FOLLOW_BATCH_SIZE
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+@transaction.atomic
+def bulk_follow(user_id, author_ids):
+    """Подписывает на список авторов пачками; возвращает id новых."""
+    created = []
+    for batch in _batches(set(author_ids) - {user_id}):
+        follows = Follow.objects.filter(user_id=user_id, author_id__in=batch)
+        existing = set(follows.values_list('author_id', flat=True))
+        if existing.issuperset(batch):
+            continue
+        # ignore_conflicts не пропускает нарушение внешнего ключа: один
+        # неизвестный id откатил бы весь импорт при коммите.
+        authors = User.objects.filter(
+            pk__in=set(batch) - existing
+        ).values_list('pk', flat=True)
+        Follow.objects.bulk_create(
+            [Follow(user_id=user_id, author_id=pk) for pk in authors],
+            ignore_conflicts=True,
+        )
+        # Конфликт с параллельной подпиской вставка молча пропускает,
+        # поэтому новые строки определяем повторной выборкой. В снимке
+        # транзакции видны только свои вставки; на READ COMMITTED
+        # подписка, закоммиченная между выборками, ещё может попасть в
+        # счётчики дважды — их поправит manage.py recount_counters.
+        new_ids = sorted(
+            set(follows.values_list('author_id', flat=True)) - existing
+        )
+        if not new_ids:
+            continue
+        followed(user_id, new_ids)
+        created.extend(new_ids)
+    return created
+
+
+@transaction.atomic
+def bulk_unfollow(user_id, author_ids):
+    """Отписывает от списка авторов пачками; возвращает id удалённых."""
+    removed = []
+    for batch in _batches(set(author_ids)):
+        follows = Follow.objects.filter(user_id=user_id, author_id__in=batch)
+        # Блокировка строк: параллельная отписка от тех же авторов
+        # дождётся коммита и не посчитает их второй раз.
+        removed_ids = sorted(
+            follows.select_for_update().values_list('author_id', flat=True)
+        )
+        if not removed_ids:
+            continue
+        _delete_rows(user_id, removed_ids)
+        unfollowed(user_id, removed_ids)
+        removed.extend(removed_ids)
+    return removed
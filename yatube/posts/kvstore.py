@@ -0,0 +1,138 @@
+import threading
+from collections import OrderedDict
+from functools import partial
+
+from django.conf import settings
+from sorl.thumbnail import default
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import deserialize_image_file
+from sorl.thumbnail.kvstores import cached_db_kvstore
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from core import metrics
+
+EMPTY_VALUE = cached_db_kvstore.EMPTY_VALUE
+
+
+class KVStore(cached_db_kvstore.KVStore):
+    """KVStore sorl с ограниченным LRU в памяти процесса.
+
+    Перед общим хранилищем (кэш + БД) стоит словарь на
+    THUMBNAIL_LRU_SIZE записей. Промахи в LRU не запоминаются, чтобы
+    миниатюра, созданная другим процессом, появилась сразу.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.maxsize = settings.THUMBNAIL_LRU_SIZE
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._lru[key] = value
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.maxsize:
+                self._lru.popitem(last=False)
+
+    def _recall(self, key):
+        with self._lock:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return self._lru[key]
+            self.misses += 1
+            return None
+
+    def _get_raw(self, key):
+        value = self._recall(key)
+        if value is None:
+            value = super()._get_raw(key)
+            if value is not None:
+                self._remember(key, value)
+        return value
+
+    def _set_raw(self, key, value):
+        super()._set_raw(key, value)
+        self._remember(key, value)
+
+    def _delete_raw(self, *keys):
+        super()._delete_raw(*keys)
+        with self._lock:
+            for key in keys:
+                self._lru.pop(key, None)
+
+    def clear(self, delete_thumbnails=False):
+        super().clear(delete_thumbnails)
+        with self._lock:
+            self._lru.clear()
+
+    def get_many(self, image_files):
+        """Находит записи сразу для нескольких картинок.
+
+        Всё, чего нет в LRU, читается одним get_many из кэша и одним
+        запросом к БД. Возвращает словарь {ключ картинки: ImageFile}.
+        """
+        keys = {add_prefix(image_file.key): image_file.key
+                for image_file in image_files}
+        values = {}
+        missing = []
+        for key in keys:
+            value = self._recall(key)
+            if value is None:
+                missing.append(key)
+            else:
+                values[key] = value
+        if missing:
+            cached = self.cache.get_many(missing)
+            absent = [key for key in missing if key not in cached]
+            if absent:
+                rows = dict(KVStoreModel.objects.filter(
+                    key__in=absent
+                ).values_list('key', 'value'))
+                self.cache.set_many(
+                    {key: rows.get(key, EMPTY_VALUE) for key in absent},
+                    thumbnail_settings.THUMBNAIL_CACHE_TIMEOUT,
+                )
+                cached.update(rows)
+            for key, value in cached.items():
+                if value != EMPTY_VALUE:
+                    self._remember(key, value)
+                    values[key] = value
+        return {
+            keys[key]: deserialize_image_file(value)
+            for key, value in values.items()
+        }
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._lru),
+                'maxsize': self.maxsize,
+            }
+
+
+STATS_DESCRIPTIONS = {
+    'hits': 'Попадания в LRU хранилища миниатюр',
+    'misses': 'Промахи LRU хранилища миниатюр',
+    'size': 'Записей в LRU хранилища миниатюр',
+}
+
+
+def _stat(field):
+    store = default.kvstore
+    return store.stats()[field] if isinstance(store, KVStore) else 0
+
+
+def register_metrics():
+    """Добавляет статистику LRU миниатюр в /metrics."""
+    for field, description in STATS_DESCRIPTIONS.items():
+        metrics.register(metrics.Gauge(
+            f'yatube_thumbnail_kvstore_{field}', description,
+            partial(_stat, field),
+        ))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from posts import thumbnails
+
+
+class Command(BaseCommand):
+    help = 'Создаёт недостающие миниатюры картинок постов'
+
+    def handle(self, *args, **options):
+        total = thumbnails.backfill()
+        self.stdout.write(self.style.SUCCESS(
+            f'Созданы миниатюры постов: {total}'
+        ))
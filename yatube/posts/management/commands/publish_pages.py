@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import static_pages
+
+
+class Command(BaseCommand):
+    help = 'Публикует статические копии главной и страниц групп'
+
+    def handle(self, *args, **options):
+        if not static_pages.is_enabled():
+            raise CommandError('Не задан STATIC_PAGES_ROOT')
+        total = static_pages.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Опубликовано страниц: {total} в {settings.STATIC_PAGES_ROOT}'
+        ))
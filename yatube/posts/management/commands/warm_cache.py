@@ -0,0 +1,37 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts.warmup import get_urls, warm
+
+
+class Command(BaseCommand):
+    help = 'Прогревает кэш первых страниц главной, групп и профилей'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--pages', type=int, default=settings.WARM_CACHE_PAGES,
+            help='Сколько первых страниц каждой ленты запросить.',
+        )
+        parser.add_argument(
+            '--profiles', type=int, default=settings.WARM_CACHE_PROFILES,
+            help='Сколько профилей с наибольшим числом подписчиков.',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=settings.WARM_CACHE_WORKERS,
+            help='Число параллельных запросов.',
+        )
+        parser.add_argument(
+            '--budget', type=float, default=settings.WARM_CACHE_BUDGET,
+            help='Ограничение времени в секундах.',
+        )
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        urls = get_urls(options['pages'], options['profiles'])
+        warmed = warm(urls, options['workers'], options['budget'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Прогрето страниц: {warmed} из {len(urls)} '
+            f'за {time.monotonic() - start:.1f} с'
+        ))
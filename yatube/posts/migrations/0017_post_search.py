@@ -0,0 +1,28 @@
+from django.db import migrations
+
+CREATE = [
+    'CREATE VIRTUAL TABLE posts_post_fts USING fts5(text)',
+    'INSERT INTO posts_post_fts (rowid, text) SELECT id, text FROM posts_post',
+]
+DROP = ['DROP TABLE IF EXISTS posts_post_fts']
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        # Полнотекстовый поиск есть только в SQLite (FTS5).
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0016_updated'),
+    ]
+
+    operations = [
+        migrations.RunPython(run(CREATE), run(DROP)),
+    ]
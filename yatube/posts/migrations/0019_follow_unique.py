@@ -0,0 +1,37 @@
+# Generated by Django 2.2.16 on 2026-10-18 18:46
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def remove_duplicates(apps, schema_editor):
+    Follow = apps.get_model('posts', 'Follow')
+    keep = Follow.objects.values('user', 'author').annotate(
+        keep_id=Min('id')
+    ).values('keep_id')
+    deleted, _ = Follow.objects.exclude(id__in=keep).delete()
+    if deleted:
+        # Счётчики подписок пересчитаются при следующем обращении.
+        Counter = apps.get_model('posts', 'Counter')
+        Counter.objects.filter(key__startswith='followers:').delete()
+        Counter.objects.filter(key__startswith='following:').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0018_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='follow',
+            constraint=models.UniqueConstraint(fields=('user', 'author'), name='unique_follow'),
+        ),
+        # Индекс уникального ограничения покрывает (user, author).
+        migrations.RemoveIndex(
+            model_name='follow',
+            name='follow_user_author_idx',
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 2.2.16 on 2026-10-18 19:25
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def mark_pulled(apps, schema_editor):
+    # До этой миграции режим автора определялся одним порогом.
+    Counter = apps.get_model('posts', 'Counter')
+    PulledAuthor = apps.get_model('posts', 'PulledAuthor')
+    keys = Counter.objects.filter(
+        key__gt='followers:',
+        key__lt='followers;',
+        value__gte=settings.FEED_PULL_THRESHOLD,
+    ).values_list('key', flat=True)
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    authors = User.objects.filter(
+        pk__in=[int(key.partition(':')[2]) for key in keys]
+    ).values_list('pk', flat=True)
+    PulledAuthor.objects.bulk_create(
+        [PulledAuthor(author_id=pk) for pk in authors]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0011_update_proxy_permissions'),
+        ('posts', '0021_post_comment_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PulledAuthor',
+            fields=[
+                ('author', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='Автор')),
+            ],
+        ),
+        migrations.RunPython(mark_pulled, migrations.RunPython.noop),
+    ]
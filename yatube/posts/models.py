@@ -5,12 +5,16 @@ User = get_user_model()
 
 
 class AbstractModel(models.Model):
-    """Абстрактная модель. Добавляет дату создания."""
+    """Абстрактная модель. Добавляет даты создания и изменения."""
     created = models.DateTimeField(
         'Дата создания',
         auto_now_add=True,
         db_index=True
     )
+    updated = models.DateTimeField(
+        'Дата изменения',
+        auto_now=True,
+    )
 
     class Meta:
         abstract = True
@@ -49,9 +53,27 @@ class Post(AbstractModel):
         upload_to='posts/',
         blank=True
     )
+    # Денормализованное число комментариев, ведут сигналы.
+    comment_count = models.PositiveIntegerField(
+        'Число комментариев',
+        default=0,
+        editable=False,
+    )
 
     class Meta:
         ordering = ('-created',)
+        # Индексы под ленты автора и группы: фильтр и сортировка по дате
+        # (включая добавочную сортировку по id) выполняются по индексу.
+        indexes = [
+            models.Index(
+                fields=['author', 'created'],
+                name='post_author_created_idx'
+            ),
+            models.Index(
+                fields=['group', 'created'],
+                name='post_group_created_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.text[:15]
@@ -73,6 +95,13 @@ class Comment(AbstractModel):
     text = models.TextField()
 
     class Meta:
+        # Курсорная пагинация комментариев поста читает этот индекс.
+        indexes = [
+            models.Index(
+                fields=['post', 'created'],
+                name='comment_post_created_idx'
+            ),
+        ]
         constraints = [
             models.UniqueConstraint(fields=[
                 'post',
@@ -95,5 +124,69 @@ class Follow(models.Model):
         verbose_name='Автор',
     )
 
+    class Meta:
+        # Индекс уникального ограничения служит и для поиска подписок.
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'author'],
+                name='unique_follow'
+            ),
+        ]
+
     def __str__(self):
         return self.user
+
+
+class TimelineEntry(models.Model):
+    """Запись материализованной ленты подписок пользователя."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Читатель',
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='Пост',
+    )
+    created = models.DateTimeField('Дата создания поста')
+
+    class Meta:
+        ordering = ('-created', '-post')
+        indexes = [
+            models.Index(
+                fields=['user', 'created', 'post'],
+                name='timeline_user_created_idx'
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'],
+                name='unique_timeline_entry'
+            ),
+        ]
+
+
+class PulledAuthor(models.Model):
+    """Автор, чьи посты подмешиваются в ленты при чтении."""
+    author = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='+',
+        verbose_name='Автор',
+    )
+
+    def __str__(self):
+        return str(self.author_id)
+
+
+class Counter(models.Model):
+    """Денормализованный счётчик: число постов, подписчиков и подписок."""
+    key = models.CharField('Ключ', max_length=64, primary_key=True)
+    value = models.IntegerField('Значение', default=0)
+
+    def __str__(self):
+        return f'{self.key}={self.value}'
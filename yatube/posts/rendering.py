@@ -0,0 +1,35 @@
+"""Рендер страниц вне цикла запроса.
+
+Фоновое обновление кэша, статические копии и прогрев вызывают view
+напрямую на собственном объекте запроса. Тестовый Client для этого не
+годится: он на время запроса отключает close_old_connections во всём
+процессе и проходит middleware, которые сбрасывают thread-local
+метрик и роутера у запроса, обрабатываемого в этом же потоке.
+"""
+from django.contrib.auth.models import AnonymousUser
+from django.http import Http404, HttpResponseNotFound
+from django.test import RequestFactory
+from django.urls import resolve
+
+_factory = RequestFactory()
+
+
+def build_request(path, user=None, **extra):
+    """Новый GET-запрос к path; без user — от анонима.
+
+    extra попадает в META, как у RequestFactory.
+    """
+    request = _factory.get(path, **extra)
+    request.user = AnonymousUser() if user is None else user
+    return request
+
+
+def render(path):
+    """Ответ view на анонимный GET path; Http404 — ответом 404."""
+    request = build_request(path)
+    try:
+        match = resolve(request.path_info)
+        request.resolver_match = match
+        return match.func(request, *match.args, **match.kwargs)
+    except Http404:
+        return HttpResponseNotFound()
@@ -0,0 +1,63 @@
+import re
+
+from django.db import connection
+
+from .models import Post
+
+# Отдельная (не external content) таблица FTS5: её не ломает
+# пересоздание posts_post миграциями SQLite.
+TABLE = 'posts_post_fts'
+
+
+def is_enabled():
+    return connection.vendor == 'sqlite'
+
+
+def index_post(post):
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE} WHERE rowid = %s', [post.pk])
+        cursor.execute(
+            f'INSERT INTO {TABLE} (rowid, text) VALUES (%s, %s)',
+            [post.pk, post.text],
+        )
+
+
+def unindex_post(post):
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE} WHERE rowid = %s', [post.pk])
+
+
+def rebuild():
+    """Заново наполняет индекс из таблицы постов; возвращает их число."""
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE}')
+        cursor.execute(
+            f'INSERT INTO {TABLE} (rowid, text) '
+            'SELECT id, text FROM posts_post'
+        )
+        return cursor.rowcount
+
+
+def build_query(text):
+    """Превращает ввод пользователя в безопасное выражение MATCH.
+
+    Каждое слово ищется как префикс, слова объединяются через AND.
+    """
+    words = re.findall(r'\w+', text)
+    return ' '.join('"{}"*'.format(word) for word in words)
+
+
+def search_posts(text, queryset=None):
+    """Посты, подходящие под запрос, от самых релевантных (bm25)."""
+    if queryset is None:
+        queryset = Post.objects.all()
+    match = build_query(text)
+    if not match:
+        return queryset.none()
+    return queryset.extra(
+        tables=[TABLE],
+        where=[f'{TABLE}.rowid = posts_post.id', f'{TABLE} MATCH %s'],
+        params=[match],
+        select={'rank': f'{TABLE}.rank'},
+        order_by=['rank'],
+    )
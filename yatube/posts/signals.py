@@ -0,0 +1,153 @@
+from django.db.models import F
+from django.db.models.signals import (
+    post_delete, post_init, post_save, pre_delete,
+)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import cache, counters, follow_graph, search, static_pages, timeline
+from .models import Comment, Follow, Group, Post, User
+
+# Поля автора, которые выводит карточка поста.
+AUTHOR_FIELDS = ('username', 'first_name', 'last_name')
+
+
+@receiver(post_init, sender=Post)
+def post_loaded(sender, instance, **kwargs):
+    # Отложенное поле не подгружаем, чтобы не плодить запросы.
+    instance._counted_group_id = instance.__dict__.get('group_id')
+
+
+def _group_tags(*group_ids):
+    slugs = Group.objects.filter(
+        pk__in=[pk for pk in group_ids if pk]
+    ).values_list('slug', flat=True)
+    return [cache.group_tag(slug) for slug in slugs]
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+    tags = [cache.INDEX, cache.post_tag(instance.pk)]
+    if created:
+        timeline.fan_out(instance)
+        counters.incr(counters.ALL_POSTS)
+        counters.incr(counters.AUTHOR_POSTS, instance.author_id)
+        tags += [cache.POSTS, cache.author_tag(instance.author.username)]
+    old_group_id = None if created else instance._counted_group_id
+    if instance.group_id != old_group_id:
+        if old_group_id:
+            counters.incr(counters.GROUP_POSTS, old_group_id, -1)
+        if instance.group_id:
+            counters.incr(counters.GROUP_POSTS, instance.group_id)
+        tags += [cache.POSTS, *_group_tags(old_group_id, instance.group_id)]
+    instance._counted_group_id = instance.group_id
+    if search.is_enabled():
+        search.index_post(instance)
+    cache.bump(*tags)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    if search.is_enabled():
+        search.unindex_post(instance)
+    cache.bump(
+        cache.INDEX,
+        cache.POSTS,
+        cache.post_tag(instance.pk),
+        cache.author_tag(instance.author.username),
+        *_group_tags(instance.group_id),
+    )
+    counters.incr(counters.ALL_POSTS, delta=-1)
+    counters.incr(counters.AUTHOR_POSTS, instance.author_id, -1)
+    if instance.group_id:
+        counters.incr(counters.GROUP_POSTS, instance.group_id, -1)
+
+
+@receiver(post_init, sender=Group)
+def group_loaded(sender, instance, **kwargs):
+    instance._rendered = (instance.title, instance.slug)
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, created, **kwargs):
+    if not created and instance._rendered != (instance.title, instance.slug):
+        # Карточки постов выводят название группы: сдвигаем их версию.
+        instance.posts.update(updated=timezone.now())
+    old_slug = instance._rendered[1]
+    instance._rendered = (instance.title, instance.slug)
+    cache.bump(
+        cache.INDEX, cache.group_tag(old_slug), cache.group_tag(instance.slug)
+    )
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleting(sender, instance, **kwargs):
+    # SET_NULL обнуляет group одним UPDATE, не трогая updated: сдвигаем
+    # версию карточек, пока посты ещё связаны с группой.
+    instance.posts.update(updated=timezone.now())
+
+
+@receiver(post_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    counters.drop(counters.GROUP_POSTS, instance.pk)
+    cache.bump(cache.INDEX, cache.group_tag(instance.slug))
+
+
+@receiver(post_init, sender=User)
+def user_loaded(sender, instance, **kwargs):
+    # Отложенные поля не подгружаем: ленты выбирают автора через only().
+    instance._rendered = tuple(
+        instance.__dict__.get(field) for field in AUTHOR_FIELDS
+    )
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    rendered = tuple(instance.__dict__.get(field) for field in AUTHOR_FIELDS)
+    if created or rendered == instance._rendered:
+        return
+    # Карточки постов выводят имя автора: сдвигаем их версию.
+    instance.posts.update(updated=timezone.now())
+    old_username = instance._rendered[0]
+    instance._rendered = rendered
+    cache.bump(
+        cache.INDEX,
+        cache.author_tag(old_username),
+        cache.author_tag(instance.username),
+    )
+
+
+@receiver(post_save, sender=Follow)
+def follow_saved(sender, instance, created, **kwargs):
+    if created:
+        follow_graph.followed(instance.user_id, [instance.author_id])
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    follow_graph.unfollowed(instance.user_id, [instance.author_id])
+
+
+def _count_comment(comment, delta):
+    Post.objects.filter(pk=comment.post_id).update(
+        comment_count=F('comment_count') + delta
+    )
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, **kwargs):
+    if created:
+        _count_comment(instance, 1)
+    cache.bump(cache.COMMENTS, cache.comments_tag(instance.post_id))
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    _count_comment(instance, -1)
+    cache.bump(cache.COMMENTS, cache.comments_tag(instance.post_id))
+
+
+@receiver(cache.versions_bumped)
+def versions_bumped(sender, namespaces, **kwargs):
+    if static_pages.is_enabled():
+        static_pages.schedule(namespaces)
@@ -0,0 +1,168 @@
+"""Статические копии страниц для анонимных посетителей.
+
+Первые страницы главной и групп у всех анонимов одинаковые, поэтому их
+можно отдавать фронтовым сервером из STATIC_PAGES_ROOT, не доходя до
+Django. Рядом с каждой страницей лежат её суррогатные ключи: после
+bump перерисовываются только страницы, помеченные сдвинутыми ключами.
+"""
+import logging
+import os
+import tempfile
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.urls import reverse
+
+from core import background
+
+from . import cache, rendering
+from .models import Group
+
+PAGE_FILE = 'index.html'
+KEYS_FILE = '.surrogate-keys'
+
+logger = logging.getLogger(__name__)
+
+# Ключи, сдвинутые в текущей транзакции потока.
+_pending = threading.local()
+
+
+def is_enabled():
+    return bool(settings.STATIC_PAGES_ROOT)
+
+
+def _group_url(slug):
+    return reverse('posts:group', kwargs={'slug': slug})
+
+
+def get_urls():
+    """Все публикуемые страницы: главная и первые страницы групп."""
+    slugs = Group.objects.values_list('slug', flat=True)
+    return [reverse('posts:index')] + [_group_url(slug) for slug in slugs]
+
+
+def _directory(url):
+    parts = [part for part in url.split('/') if part]
+    return os.path.join(settings.STATIC_PAGES_ROOT, *parts)
+
+
+def _write(path, content):
+    """Атомарная запись: фронт не увидит недописанный файл."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(content)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _remove(directory):
+    for name in (PAGE_FILE, KEYS_FILE):
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+
+
+def publish(url):
+    """Перерисовывает страницу; если её больше нет, удаляет копию.
+
+    View вызывается напрямую на анонимном запросе, без middleware.
+    Чтение из реплик включает только middleware, поэтому страница
+    читается из основной базы и видит только что закоммиченное.
+    Ошибку или устаревший ответ не публикуем — остаётся прежняя копия.
+    """
+    response = rendering.render(url)
+    directory = _directory(url)
+    if response.status_code == 404:
+        _remove(directory)
+        return False
+    if response.status_code != 200 or response.has_header('Warning'):
+        logger.warning(
+            'Страница %s не опубликована: %s', url, response.status_code
+        )
+        return False
+    keys = response.get('Surrogate-Key', '')
+    _write(os.path.join(directory, KEYS_FILE), keys.encode())
+    _write(os.path.join(directory, PAGE_FILE), response.content)
+    return True
+
+
+def published():
+    """Опубликованные страницы: адрес и множество суррогатных ключей."""
+    root = settings.STATIC_PAGES_ROOT
+    for directory, _, files in os.walk(root):
+        if KEYS_FILE not in files:
+            continue
+        with open(os.path.join(directory, KEYS_FILE)) as file:
+            keys = set(file.read().split())
+        relative = os.path.relpath(directory, root)
+        if relative == os.curdir:
+            yield '/', keys
+        else:
+            yield '/{}/'.format(relative.replace(os.sep, '/')), keys
+
+
+def affected(keys):
+    """Адреса страниц, которые надо перерисовать после bump(keys)."""
+    keys = set(keys)
+    urls = {url for url, tags in published() if tags & keys}
+    # Страницы новой или переименованной группы ещё нет среди
+    # опубликованных, но её ключ сдвигается при сохранении группы.
+    prefix = cache.group_tag('')
+    urls.update(
+        _group_url(key[len(prefix):])
+        for key in keys if key.startswith(prefix)
+    )
+    return urls
+
+
+def publish_affected(keys):
+    """Перерисовывает страницы, затронутые ключами; возвращает их число."""
+    published_count = 0
+    for url in sorted(affected(keys)):
+        try:
+            published_count += publish(url)
+        except Exception:
+            logger.exception('Не удалось опубликовать %s', url)
+    return published_count
+
+
+def _flush():
+    keys = getattr(_pending, 'keys', None)
+    _pending.keys = None
+    if not keys:
+        return
+    background.submit(
+        'static-pages', 'STATIC_PAGES_WORKERS', publish_affected, keys
+    )
+
+
+def schedule(keys):
+    """Перерисовка после коммита: страница должна увидеть изменения.
+
+    Ключи всех bump транзакции копятся вместе, и после коммита каждая
+    затронутая страница перерисовывается один раз, в фоновом потоке.
+    Ключи откаченной транзакции уйдут со следующим коммитом: лишняя
+    перерисовка безвредна.
+    """
+    pending = getattr(_pending, 'keys', None)
+    if pending is None:
+        pending = _pending.keys = set()
+    pending.update(keys)
+    transaction.on_commit(_flush)
+
+
+def rebuild():
+    """Публикует все страницы и удаляет копии исчезнувших."""
+    urls = get_urls()
+    for url, _ in list(published()):
+        if url not in urls:
+            _remove(_directory(url))
+    return sum(publish(url) for url in urls)
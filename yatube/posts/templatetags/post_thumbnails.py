@@ -0,0 +1,19 @@
+from django import template
+
+from posts import thumbnails
+
+register = template.Library()
+
+
+@register.simple_tag
+def post_thumbnail(image, name='card'):
+    """Готовая миниатюра картинки поста; шаблон не генерирует её сам.
+
+    Если миниатюры нет, её генерация снова ставится в очередь.
+    """
+    if not image:
+        return None
+    thumbnail = thumbnails.get_ready(image, name)
+    if thumbnail is None:
+        thumbnails.retry(image.instance.pk)
+    return thumbnail
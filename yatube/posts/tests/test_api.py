@@ -0,0 +1,101 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from posts.models import Follow, Group, Post
+
+User = get_user_model()
+
+
+class FeedApiTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='reader')
+        cls.author = User.objects.create_user(
+            username='author', first_name='Имя', last_name='Фамилия'
+        )
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание'
+        )
+        for number in range(5):
+            author = User.objects.create_user(username=f'author{number}')
+            Post.objects.create(
+                text=f'Текст {number}', author=author, group=cls.group
+            )
+        cls.post = Post.objects.create(text='Без группы', author=cls.author)
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.reader)
+
+    def test_page_resolves_relations_in_batches(self):
+        # Пост, авторы и группы — по одному запросу на тип.
+        with self.assertNumQueries(3):
+            response = self.client.get(
+                reverse('posts:api_index'), {'limit': 4}
+            )
+        data = response.json()
+        self.assertEqual(
+            [post['text'] for post in data['results']],
+            ['Без группы', 'Текст 4', 'Текст 3', 'Текст 2'],
+        )
+        first = data['results'][0]
+        self.assertEqual(
+            first['author'],
+            {'username': 'author', 'full_name': 'Имя Фамилия'},
+        )
+        self.assertIsNone(first['group'])
+        self.assertEqual(data['results'][1]['group']['slug'], 'test-slug')
+        self.assertIsNone(first['image'])
+        self.assertTrue(first['url'].endswith(f'/posts/{self.post.pk}/'))
+        response = self.client.get(
+            reverse('posts:api_index'),
+            {'limit': 4, 'cursor': data['next_cursor']},
+        )
+        data = response.json()
+        self.assertEqual(
+            [post['text'] for post in data['results']],
+            ['Текст 1', 'Текст 0'],
+        )
+        self.assertIsNone(data['next_cursor'])
+
+    def test_group_and_profile_feeds(self):
+        feeds = {
+            reverse('posts:api_group', kwargs={'slug': 'test-slug'}): 5,
+            reverse('posts:api_profile', kwargs={'username': 'author'}): 1,
+        }
+        for url, total in feeds.items():
+            with self.subTest(url=url):
+                results = self.client.get(url).json()['results']
+                self.assertEqual(len(results), total)
+        missing = reverse('posts:api_group', kwargs={'slug': 'missing'})
+        self.assertEqual(self.client.get(missing).status_code, 404)
+
+    def test_follow_feed(self):
+        url = reverse('posts:api_follow_index')
+        self.assertEqual(self.client.get(url).status_code, 401)
+        results = self.authorized_client.get(url).json()['results']
+        self.assertEqual([post['id'] for post in results], [self.post.pk])
+
+    @override_settings(API_EXPORT_BATCH_SIZE=2)
+    def test_export_streams_whole_feed(self):
+        url = reverse('posts:api_group', kwargs={'slug': 'test-slug'})
+        response = self.client.get(url, {'export': 1})
+        self.assertTrue(response.streaming)
+        # Три пачки постов и их авторов; группа загружается один раз.
+        with self.assertNumQueries(7):
+            content = b''.join(response.streaming_content)
+        results = json.loads(content)['results']
+        self.assertEqual(
+            [post['text'] for post in results],
+            [f'Текст {number}' for number in range(4, -1, -1)],
+        )
@@ -1,13 +1,25 @@
 import shutil
 import tempfile
+from io import StringIO
+from unittest import mock
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase, override_settings
+from django.core.management import call_command
+from django.db import OperationalError
+from django.test import (
+    Client, RequestFactory, TestCase, TransactionTestCase, override_settings,
+)
+from django.urls import reverse
 
-from posts.models import Group, Post
+from posts import views
+from posts.cache import (
+    INDEX, POSTS, STALE_WARNING, _CachedPage, _anonymous_key, author_tag, bump,
+    group_tag, post_tag,
+)
+from posts.models import Follow, Group, Post
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
@@ -52,14 +64,316 @@ class CasheFormTests(TestCase):
         shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
 
     def setUp(self):
+        cache.clear()
         self.guest_client = Client()
         self.authorized_client = Client()
         self.authorized_client.force_login(self.user)
 
-    def test_delete_cache_post(self):
+    def test_new_post_invalidates_index(self):
         response = self.authorized_client.get('/')
         post = Post.objects.create(author=self.user)
-        self.assertNotIn(post, response.context['page_obj'])
-        cache.clear()
         response = self.authorized_client.get('/')
         self.assertIn(post, response.context['page_obj'])
+
+    def test_index_served_from_cache(self):
+        self.guest_client.get('/')
+        Post.objects.filter(pk=self.post.pk).update(text='Без сигналов')
+        response = self.guest_client.get('/')
+        self.assertNotContains(response, 'Без сигналов')
+        cache.clear()
+        response = self.guest_client.get('/')
+        self.assertContains(response, 'Без сигналов')
+
+    def test_group_rename_invalidates_index(self):
+        self.guest_client.get('/')
+        self.group.title = 'Новое название'
+        self.group.save()
+        response = self.guest_client.get('/')
+        self.assertContains(response, 'Новое название')
+
+    def test_group_delete_invalidates_post_card(self):
+        group_url = reverse('posts:group', kwargs={'slug': self.group.slug})
+        self.assertContains(self.guest_client.get('/'), group_url)
+        Group.objects.get(pk=self.group.pk).delete()
+        response = self.guest_client.get('/')
+        self.assertNotContains(response, group_url)
+
+    def test_post_card_fragment_cached_by_version(self):
+        url = reverse('posts:group', kwargs={'slug': self.group.slug})
+        self.guest_client.get(url)
+        Post.objects.filter(pk=self.post.pk).update(text='Без сигналов')
+        response = self.guest_client.get(url)
+        self.assertNotContains(response, 'Без сигналов')
+        self.post.text = 'Отредактировано'
+        self.post.save()
+        response = self.guest_client.get(url)
+        self.assertContains(response, 'Отредактировано')
+
+    def test_author_rename_invalidates_post_card(self):
+        url = reverse('posts:group', kwargs={'slug': self.group.slug})
+        self.guest_client.get(url)
+        author = User.objects.get(pk=self.user.pk)
+        author.first_name = 'Новое'
+        author.last_name = 'Имя'
+        author.save()
+        response = self.guest_client.get(url)
+        self.assertContains(response, 'Новое Имя')
+
+    @override_settings(
+        PAGE_CACHE_STALE_WHILE_REVALIDATE=60, PAGE_CACHE_REFRESH_WORKERS=0
+    )
+    def test_stale_while_revalidate(self):
+        self.guest_client.get('/')
+        Post.objects.create(author=self.user, text='Новый пост')
+        response = self.guest_client.get('/')
+        self.assertEqual(response['Warning'], STALE_WARNING)
+        self.assertNotContains(response, 'Новый пост')
+        response = self.guest_client.get('/')
+        self.assertFalse(response.has_header('Warning'))
+        self.assertContains(response, 'Новый пост')
+
+    @override_settings(
+        PAGE_CACHE_STALE_WHILE_REVALIDATE=60, PAGE_CACHE_REFRESH_WORKERS=0
+    )
+    def test_refresh_renders_separate_request(self):
+        self.guest_client.get('/')
+        Post.objects.create(author=self.user, text='Новый пост')
+        requests = []
+        refresh = _CachedPage.refresh
+
+        def spy(page, request):
+            requests.append(request)
+            refresh(page, request)
+
+        with mock.patch.object(_CachedPage, 'refresh', spy):
+            response = self.guest_client.get('/')
+        self.assertEqual(response['Warning'], STALE_WARNING)
+        original = response.wsgi_request
+        detached, = requests
+        self.assertIsNot(detached, original)
+        self.assertEqual(detached.method, 'GET')
+        self.assertEqual(detached.get_full_path(), '/')
+        self.assertFalse(detached.user.is_authenticated)
+        self.assertIsNot(detached.surrogate_keys, original.surrogate_keys)
+
+    def test_stale_if_database_error(self):
+        url = reverse('posts:group', kwargs={'slug': self.group.slug})
+        self.guest_client.get(url)
+        bump(INDEX, group_tag(self.group.slug))
+        with mock.patch(
+            'posts.views.get_feed', side_effect=OperationalError('locked')
+        ):
+            with self.assertLogs('posts.cache', 'ERROR'):
+                response = self.guest_client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Warning'], STALE_WARNING)
+            cache.clear()
+            with self.assertRaises(OperationalError):
+                self.guest_client.get(url)
+
+    def test_stale_if_user_lookup_fails(self):
+        url = reverse('posts:group', kwargs={'slug': self.group.slug})
+        first = self.authorized_client.get(url)
+        bump(INDEX, group_tag(self.group.slug))
+        with mock.patch(
+            'django.contrib.auth.get_user',
+            side_effect=OperationalError('locked'),
+        ):
+            with self.assertLogs('posts.cache', 'ERROR'):
+                response = self.authorized_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Warning'], STALE_WARNING)
+        self.assertEqual(response.content, first.content)
+
+
+class ConditionalGetTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.post = Post.objects.create(text='Текст', author=cls.user)
+
+    def setUp(self):
+        cache.clear()
+
+    def revalidate(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header('Last-Modified'))
+        return response['ETag']
+
+    def test_not_modified_without_queries(self):
+        url = reverse('posts:index')
+        etag = self.revalidate(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        Post.objects.create(text='Новый', author=self.user)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_stale_response_has_no_validators(self):
+        url = reverse('posts:index')
+        etag = self.revalidate(url)
+        bump(INDEX, POSTS)
+        with mock.patch(
+            'posts.views.get_feed', side_effect=OperationalError('locked')
+        ):
+            with self.assertLogs('posts.cache', 'ERROR'):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Warning'], STALE_WARNING)
+        self.assertFalse(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Last-Modified'))
+
+    def test_etag_changes_with_csrf_secret(self):
+        self.client.force_login(self.user)
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        # Первый ответ выдаёт cookie CSRF, с ним ETag уже не меняется.
+        self.client.get(url)
+        etag = self.revalidate(url)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        # После повторного входа секрет CSRF другой: старый токен в
+        # форме закэшированной страницы уже не подходит.
+        self.client.cookies[settings.CSRF_COOKIE_NAME] = 'a' * 64
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_validators_follow_resource_changes(self):
+        reader = User.objects.create_user(username='reader')
+        changes = {
+            reverse('posts:profile', kwargs={'username': 'auth'}):
+                lambda: Follow.objects.create(user=reader, author=self.user),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}):
+                lambda: self.post.comments.create(author=reader, text='К'),
+        }
+        for url, change in changes.items():
+            with self.subTest(url=url):
+                etag = self.revalidate(url)
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                change()
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+
+
+class AnonymousPageCacheTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.other = User.objects.create_user(username='other')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание'
+        )
+        cls.post = Post.objects.create(
+            text='Текст', author=cls.user, group=cls.group
+        )
+        cls.other_post = Post.objects.create(text='Другой', author=cls.other)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_anonymous_page_served_without_queries(self):
+        url = reverse('posts:group', kwargs={'slug': 'test-slug'})
+        response = self.client.get(url)
+        self.assertIn(group_tag('test-slug'), response['Surrogate-Key'])
+        self.assertIn(post_tag(self.post.pk), response['Surrogate-Key'])
+        with self.assertNumQueries(0):
+            cached = self.client.get(url)
+        self.assertEqual(cached.content, response.content)
+
+    def test_post_edit_purges_only_tagged_pages(self):
+        own = reverse('posts:profile', kwargs={'username': 'auth'})
+        foreign = reverse('posts:profile', kwargs={'username': 'other'})
+        for url in (own, foreign):
+            self.client.get(url)
+        self.post.text = 'Исправленный текст'
+        self.post.save()
+        with self.assertNumQueries(0):
+            self.client.get(foreign)
+        response = self.client.get(own)
+        self.assertContains(response, 'Исправленный текст')
+
+    def test_comment_purges_post_detail(self):
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        self.client.get(url)
+        self.post.comments.create(author=self.other, text='Комментарий')
+        self.assertContains(self.client.get(url), 'Комментарий')
+
+    def test_change_during_render_is_not_cached(self):
+        url = reverse('posts:group', kwargs={'slug': 'test-slug'})
+        key = _anonymous_key(RequestFactory().get(url))
+        get_feed = views.get_feed
+
+        def change_during_render(queryset):
+            bump(post_tag(self.post.pk))
+            return get_feed(queryset)
+
+        with mock.patch(
+            'posts.views.get_feed', side_effect=change_during_render
+        ):
+            self.client.get(url)
+        self.assertIsNone(cache.get(key))
+        self.client.get(url)
+        self.assertIsNotNone(cache.get(key))
+
+    def test_miss_after_bump_is_single_flight(self):
+        url = reverse('posts:profile', kwargs={'username': 'auth'})
+        self.client.get(url)
+        bump(author_tag('auth'))
+        with mock.patch.object(
+            cache, 'get_or_set', wraps=cache.get_or_set
+        ) as get_or_set:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        get_or_set.assert_called_once()
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+    def test_authorized_user_bypasses_anonymous_cache(self):
+        url = reverse('posts:index')
+        self.client.get(url)
+        self.client.force_login(self.user)
+        response = self.client.get(url)
+        self.assertFalse(response.has_header('Surrogate-Key'))
+
+
+class WarmCacheTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author')
+        reader = User.objects.create_user(username='reader')
+        Follow.objects.create(user=reader, author=self.author)
+        self.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание'
+        )
+        Post.objects.create(text='Текст', author=self.author, group=self.group)
+
+    def warm(self, *args):
+        out = StringIO()
+        # Тестовая база SQLite в памяти блокирует таблицы без ожидания:
+        # параллельные рендеры падали бы с «database table is locked».
+        call_command(
+            'warm_cache', '--pages=1', '--workers=1', *args, stdout=out
+        )
+        return out.getvalue()
+
+    def test_warm_cache(self):
+        output = self.warm()
+        # Главная, группа и профиль автора с подписчиком.
+        self.assertIn('Прогрето страниц: 3 из 3', output)
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, 'Текст')
+
+    def test_warm_cache_budget(self):
+        self.assertIn('Прогрето страниц: 0 из 3', self.warm('--budget=0'))
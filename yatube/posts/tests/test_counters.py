@@ -0,0 +1,71 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from posts import counters
+from posts.models import Counter, Follow, Group, Post
+
+User = get_user_model()
+
+
+class CountersTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='user')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Test',
+            slug='Test',
+            description='Test'
+        )
+        cls.other_group = Group.objects.create(
+            title='Other',
+            slug='other',
+            description='Other'
+        )
+        cls.post = Post.objects.create(
+            text='Test',
+            author=cls.user,
+            group=cls.group
+        )
+
+    def setUp(self):
+        self.client = Client()
+
+    def test_post_counters(self):
+        post = Post.objects.create(text='New', author=self.user)
+        self.assertEqual(counters.get(counters.ALL_POSTS), 2)
+        self.assertEqual(counters.get(counters.AUTHOR_POSTS, self.user.pk), 2)
+        post.group = self.other_group
+        post.save()
+        self.assertEqual(
+            counters.get(counters.GROUP_POSTS, self.other_group.pk), 1
+        )
+        post.delete()
+        self.assertEqual(counters.get(counters.ALL_POSTS), 1)
+        self.assertEqual(
+            counters.get(counters.GROUP_POSTS, self.other_group.pk), 0
+        )
+
+    def test_follow_counters(self):
+        Follow.objects.create(user=self.reader, author=self.user)
+        response = self.client.get(
+            reverse('posts:profile', kwargs={'username': self.user})
+        )
+        self.assertEqual(response.context['post_count'], 1)
+        self.assertEqual(response.context['followers_count'], 1)
+        self.assertEqual(response.context['following_count'], 0)
+
+    def test_recount_fixes_drift(self):
+        counters.get(counters.ALL_POSTS)
+        Counter.objects.filter(key=counters.ALL_POSTS).update(value=42)
+        call_command('recount_counters', stdout=StringIO())
+        self.assertEqual(counters.get(counters.ALL_POSTS), 1)
+        self.assertEqual(
+            counters.get(counters.GROUP_POSTS, self.group.pk), 1
+        )
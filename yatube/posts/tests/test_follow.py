@@ -1,13 +1,21 @@
 import shutil
 import tempfile
+from unittest import mock
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
 
-from posts.models import Comment, Follow, Group, Post
+from posts import counters, follow_graph
+from posts.models import (
+    Comment, Follow, Group, Post, PulledAuthor, TimelineEntry,
+)
+
+from yatube.settings import PAGINATOR_CONST
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
@@ -57,6 +65,7 @@ class PostCreateFormTests(TestCase):
         shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
 
     def setUp(self):
+        cache.clear()
         self.guest_client = Client()
         self.authorized_client = Client()
         self.authorized_client.force_login(self.user)
@@ -97,3 +106,216 @@ class PostCreateFormTests(TestCase):
         self.client.login(username='NewUser', password='New12345')
         response = self.client.get(reverse('posts:follow_index'))
         self.assertNotIn(follow_post, response.context['page_obj'])
+
+    def test_timeline_fan_out(self):
+        Follow.objects.create(user=self.user, author=self.follower)
+        post = Post.objects.create(author=self.follower)
+        self.assertTrue(
+            TimelineEntry.objects.filter(user=self.user, post=post).exists()
+        )
+
+    def test_timeline_backfill_and_trim(self):
+        old_post = Post.objects.create(author=self.follower)
+        follow = Follow.objects.create(user=self.user, author=self.follower)
+        response = self.authorized_client.get(reverse('posts:follow_index'))
+        self.assertIn(old_post, response.context['page_obj'])
+        follow.delete()
+        self.assertFalse(
+            TimelineEntry.objects.filter(user=self.user).exists()
+        )
+
+    def test_follow_graph_cached(self):
+        Follow.objects.create(user=self.user, author=self.follower)
+        self.assertTrue(
+            follow_graph.is_following(self.user.pk, self.follower.pk)
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                follow_graph.get_followees(self.user.pk),
+                {self.follower.pk}
+            )
+        Follow.objects.filter(user=self.user, author=self.follower).delete()
+        # После отписки множество перечитывается одним запросом.
+        with self.assertNumQueries(1):
+            self.assertFalse(
+                follow_graph.is_following(self.user.pk, self.follower.pk)
+            )
+
+    def test_profile_following_is_for_viewer(self):
+        other = User.objects.create_user(username='other')
+        Follow.objects.create(user=other, author=self.follower)
+        url = reverse('posts:profile', kwargs={'username': self.follower})
+        response = self.authorized_client.get(url)
+        self.assertFalse(response.context['following'])
+        Follow.objects.create(user=self.user, author=self.follower)
+        response = self.authorized_client.get(url)
+        self.assertTrue(response.context['following'])
+
+    def test_follow_is_idempotent(self):
+        url = reverse(
+            'posts:profile_follow', kwargs={'username': self.follower}
+        )
+        self.authorized_client.post(url)
+        self.authorized_client.post(url, HTTP_REFERER='/')
+        self.assertEqual(
+            Follow.objects.filter(
+                user=self.user, author=self.follower
+            ).count(),
+            1
+        )
+        self.assertEqual(
+            counters.get(counters.FOLLOWERS, self.follower.pk), 1
+        )
+
+    def test_unfollow_missing_follow(self):
+        self.assertFalse(follow_graph.unfollow(self.user.pk, self.follower.pk))
+        self.assertEqual(
+            counters.get(counters.FOLLOWING, self.user.pk), 0
+        )
+
+    def test_bulk_follow_and_unfollow(self):
+        authors = [
+            User.objects.create_user(username=f'author{i}')
+            for i in range(3)
+        ]
+        author_ids = [author.pk for author in authors]
+        post = Post.objects.create(author=authors[0])
+        Follow.objects.create(user=self.user, author=authors[0])
+        with self.settings(FOLLOW_BATCH_SIZE=2):
+            created = follow_graph.bulk_follow(
+                self.user.pk, author_ids + [self.user.pk]
+            )
+        self.assertEqual(created, author_ids[1:])
+        self.assertEqual(
+            follow_graph.get_followees(self.user.pk), set(author_ids)
+        )
+        self.assertEqual(counters.get(counters.FOLLOWING, self.user.pk), 3)
+        removed = follow_graph.bulk_unfollow(self.user.pk, author_ids[:2])
+        self.assertEqual(removed, author_ids[:2])
+        self.assertEqual(
+            list(Follow.objects.filter(user=self.user).values_list(
+                'author_id', flat=True
+            )),
+            author_ids[2:]
+        )
+        self.assertEqual(counters.get(counters.FOLLOWING, self.user.pk), 1)
+        self.assertEqual(counters.get(counters.FOLLOWERS, authors[0].pk), 0)
+        self.assertFalse(
+            TimelineEntry.objects.filter(user=self.user, post=post).exists()
+        )
+
+    def test_bulk_follow_skips_unknown_authors(self):
+        author = User.objects.create_user(username='author')
+        created = follow_graph.bulk_follow(self.user.pk, [author.pk, 99999])
+        self.assertEqual(created, [author.pk])
+        connection.check_constraints()
+        self.assertEqual(
+            follow_graph.get_followees(self.user.pk), {author.pk}
+        )
+
+    def test_bulk_follow_counts_only_inserted_rows(self):
+        authors = [
+            User.objects.create_user(username=f'author{i}')
+            for i in range(2)
+        ]
+        bulk_create = Follow.objects.bulk_create
+
+        def conflicting(objs, **kwargs):
+            # Подписку на первого автора как будто уже вставила
+            # параллельная транзакция: ignore_conflicts её пропустит.
+            return bulk_create(
+                [obj for obj in objs if obj.author_id != authors[0].pk],
+                **kwargs,
+            )
+
+        with mock.patch.object(Follow.objects, 'bulk_create', conflicting):
+            created = follow_graph.bulk_follow(
+                self.user.pk, [author.pk for author in authors]
+            )
+        self.assertEqual(created, [authors[1].pk])
+        self.assertEqual(counters.get(counters.FOLLOWING, self.user.pk), 1)
+        self.assertEqual(counters.get(counters.FOLLOWERS, authors[0].pk), 0)
+
+    @override_settings(
+        FEED_PULL_THRESHOLD=2, FEED_PUSH_THRESHOLD=2, TIMELINE_WORKERS=0
+    )
+    # TestCase не коммитит: колбэки on_commit выполняем сразу.
+    @mock.patch('django.db.transaction.on_commit', lambda func: func())
+    def test_hybrid_feed(self):
+        other = User.objects.create_user(username='other')
+        star = User.objects.create_user(username='star')
+        old_star_post = Post.objects.create(author=star, text='old star')
+        Follow.objects.create(user=self.user, author=star)
+        Follow.objects.create(user=self.user, author=self.follower)
+        self.assertTrue(
+            TimelineEntry.objects.filter(post=old_star_post).exists()
+        )
+        # Второй подписчик переводит автора в чтение при выводе ленты.
+        Follow.objects.create(user=other, author=star)
+        self.assertFalse(
+            TimelineEntry.objects.filter(post__author=star).exists()
+        )
+        posts = []
+        for number in range(PAGINATOR_CONST + 1):
+            author = star if number % 2 else self.follower
+            posts.append(Post.objects.create(author=author, text=number))
+        self.assertFalse(
+            TimelineEntry.objects.filter(post__author=star).exists()
+        )
+        expected = list(reversed(posts))[:PAGINATOR_CONST]
+        response = self.authorized_client.get(reverse('posts:follow_index'))
+        self.assertEqual(list(response.context['page_obj']), expected)
+        response = self.authorized_client.get(
+            reverse('posts:follow_index'), {'page': 2}
+        )
+        self.assertEqual(
+            list(response.context['page_obj']),
+            [*reversed(posts), old_star_post][PAGINATOR_CONST:]
+        )
+        with self.settings(PAGINATOR_CURSOR=True):
+            response = self.authorized_client.get(
+                reverse('posts:follow_index')
+            )
+            self.assertEqual(list(response.context['page_obj']), expected)
+            response = self.authorized_client.get(
+                reverse('posts:follow_index'),
+                {'cursor': response.context['page_obj'].next_cursor},
+            )
+            self.assertEqual(
+                list(response.context['page_obj']),
+                [*reversed(posts), old_star_post][PAGINATOR_CONST:]
+            )
+        # Ниже порога посты автора снова раскладываются по лентам.
+        Follow.objects.filter(user=other, author=star).delete()
+        self.assertEqual(
+            TimelineEntry.objects.filter(
+                user=self.user, post__author=star
+            ).count(),
+            star.posts.count()
+        )
+
+    @override_settings(
+        FEED_PULL_THRESHOLD=3, FEED_PUSH_THRESHOLD=2, TIMELINE_WORKERS=0
+    )
+    @mock.patch('django.db.transaction.on_commit', lambda func: func())
+    def test_pull_and_push_thresholds_differ(self):
+        star = User.objects.create_user(username='star')
+        Post.objects.create(author=star, text='star')
+        readers = [
+            User.objects.create_user(username=f'reader{number}')
+            for number in range(3)
+        ]
+        for reader in readers:
+            Follow.objects.create(user=reader, author=star)
+        self.assertTrue(PulledAuthor.objects.filter(author=star).exists())
+        self.assertFalse(TimelineEntry.objects.exists())
+        # Между порогами автор остаётся в прежнем режиме.
+        Follow.objects.filter(user=readers[0], author=star).delete()
+        self.assertTrue(PulledAuthor.objects.filter(author=star).exists())
+        Follow.objects.create(user=readers[0], author=star)
+        Follow.objects.filter(user__in=readers[:2], author=star).delete()
+        self.assertFalse(PulledAuthor.objects.filter(author=star).exists())
+        self.assertEqual(
+            list(TimelineEntry.objects.values_list('user', flat=True)),
+            [readers[2].pk],
+        )
@@ -0,0 +1,101 @@
+import re
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from core.slow_queries import explain
+from posts.models import Comment, Follow, Group, Post, PulledAuthor
+from posts.utils import BACKWARD, FORWARD, encode_cursor
+
+User = get_user_model()
+
+# Полный просмотр таблицы без индекса или сортировка во временном B-дереве.
+BAD_PLAN = re.compile(r'^SCAN (TABLE )?\w+( AS \w+)?$|TEMP B-TREE')
+
+# Небольшие таблицы, которые читаются целиком и кэшируются.
+WHOLE_TABLES = ('posts_pulledauthor',)
+
+
+class QueryPlanTests(TestCase):
+    """Каждый запрос страниц ленты должен идти по индексу."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='user')
+        cls.author = User.objects.create_user(username='author')
+        cls.group = Group.objects.create(
+            title='Test',
+            slug='test-slug',
+            description='Test'
+        )
+        cls.post = Post.objects.create(
+            text='Test',
+            author=cls.author,
+            group=cls.group,
+        )
+        Comment.objects.create(post=cls.post, author=cls.user, text='Test')
+        Follow.objects.create(user=cls.user, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def assertIndexedQueries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        for query in queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT') or any(
+                sql.startswith(f'SELECT "{table}".') for table in WHOLE_TABLES
+            ):
+                continue
+            # Параметры уже подставлены в текст запроса отладочным курсором.
+            for step in explain(connection, sql, ()):
+                with self.subTest(url=url, sql=sql):
+                    self.assertIsNone(BAD_PLAN.search(step), step)
+
+    def test_feed_query_plans(self):
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': 'author'}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+            reverse('posts:follow_index'),
+            reverse('posts:profile', kwargs={'username': 'user'}),
+        )
+        for url in urls:
+            self.assertIndexedQueries(url)
+
+    @override_settings(PAGINATOR_CURSOR=True)
+    def test_cursor_query_plans(self):
+        position = (self.post.created, self.post.pk)
+        for direction in (FORWARD, BACKWARD):
+            cursor = encode_cursor(direction, position)
+            for url in (
+                reverse('posts:index'),
+                reverse('posts:group', kwargs={'slug': self.group.slug}),
+                reverse('posts:profile', kwargs={'username': 'author'}),
+                reverse('posts:follow_index'),
+            ):
+                self.assertIndexedQueries(f'{url}?cursor={cursor}')
+
+    def test_comment_query_plans(self):
+        cursor = encode_cursor(FORWARD, (self.post.created, 0))
+        url = reverse('posts:post_comments', kwargs={'post_id': self.post.pk})
+        self.assertIndexedQueries(f'{url}?cursor={cursor}')
+
+    def test_pulled_feed_query_plans(self):
+        Post.objects.create(text='Test', author=self.author)
+        Follow.objects.create(user=self.author, author=self.user)
+        PulledAuthor.objects.create(author=self.author)
+        PulledAuthor.objects.create(author=self.user)
+        url = reverse('posts:follow_index')
+        self.assertIndexedQueries(url)
+        cursor = encode_cursor(FORWARD, (self.post.created, self.post.pk))
+        self.assertIndexedQueries(f'{url}?cursor={cursor}')
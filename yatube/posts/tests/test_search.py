@@ -0,0 +1,57 @@
+from django.contrib.admin.sites import site
+from django.contrib.auth import get_user_model
+from django.test import Client, RequestFactory, TestCase
+from django.urls import reverse
+
+from posts.models import Post
+from posts.search import build_query
+
+User = get_user_model()
+
+
+class SearchTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='user')
+        cls.post = Post.objects.create(
+            text='Сегодня гуляли по набережной',
+            author=cls.user,
+        )
+        cls.other_post = Post.objects.create(
+            text='Рецепт борща',
+            author=cls.user,
+        )
+
+    def setUp(self):
+        self.client = Client()
+
+    def search(self, query):
+        response = self.client.get(reverse('posts:search'), {'q': query})
+        return list(response.context['page_obj'])
+
+    def test_search_finds_by_prefix(self):
+        self.assertEqual(self.search('набережн'), [self.post])
+
+    def test_index_follows_edit_and_delete(self):
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = 'Прогулка'
+        post.save()
+        self.assertEqual(self.search('набережной'), [])
+        self.assertEqual(self.search('прогулка'), [post])
+        post.delete()
+        self.assertEqual(self.search('прогулка'), [])
+
+    def test_query_is_sanitized(self):
+        self.assertEqual(build_query('"борщ" OR *'), '"борщ"* "OR"*')
+        self.assertEqual(self.search('"борщ'), [self.other_post])
+        self.assertEqual(self.search('  '), [])
+
+    def test_admin_uses_index(self):
+        admin_model = site._registry[Post]
+        request = RequestFactory().get('/')
+        queryset, _ = admin_model.get_search_results(
+            request, Post.objects.all(), 'борщ'
+        )
+        self.assertEqual(list(queryset), [self.other_post])
@@ -0,0 +1,97 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TransactionTestCase, override_settings
+
+from posts import static_pages
+from posts.models import Group, Post
+
+TEMP_PAGES_ROOT = tempfile.mkdtemp()
+
+User = get_user_model()
+
+
+@override_settings(STATIC_PAGES_ROOT=TEMP_PAGES_ROOT, STATIC_PAGES_WORKERS=0)
+class StaticPagesTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author')
+        self.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание'
+        )
+        self.other_group = Group.objects.create(
+            title='Другая группа',
+            slug='other-slug',
+            description='Тестовое описание'
+        )
+        self.post = Post.objects.create(
+            text='Текст', author=self.author, group=self.group
+        )
+        call_command('publish_pages', stdout=StringIO())
+
+    def tearDown(self):
+        shutil.rmtree(TEMP_PAGES_ROOT, ignore_errors=True)
+
+    def page(self, *parts):
+        path = os.path.join(TEMP_PAGES_ROOT, *parts, 'index.html')
+        with open(path, encoding='utf-8') as file:
+            return file.read()
+
+    def test_publish_pages(self):
+        self.assertIn('Текст', self.page())
+        self.assertIn('Текст', self.page('group', 'test-slug'))
+        self.assertNotIn('Текст', self.page('group', 'other-slug'))
+
+    def test_only_affected_pages_republished(self):
+        other = os.path.join(
+            TEMP_PAGES_ROOT, 'group', 'other-slug', 'index.html'
+        )
+        mtime = os.stat(other).st_mtime_ns
+        self.post.text = 'Исправленный текст'
+        self.post.save()
+        self.assertIn('Исправленный текст', self.page())
+        self.assertIn('Исправленный текст', self.page('group', 'test-slug'))
+        self.assertEqual(os.stat(other).st_mtime_ns, mtime)
+
+    def test_transaction_publishes_each_page_once(self):
+        with mock.patch(
+            'posts.static_pages.publish', wraps=static_pages.publish
+        ) as publish:
+            with transaction.atomic():
+                self.post.text = 'Исправленный текст'
+                self.post.save()
+                Post.objects.create(
+                    text='Второй пост', author=self.author, group=self.group
+                )
+                publish.assert_not_called()
+        self.assertEqual(
+            sorted(call[0][0] for call in publish.call_args_list),
+            ['/', '/group/test-slug/'],
+        )
+        self.assertIn('Второй пост', self.page())
+
+    def test_comment_does_not_republish_index(self):
+        index = os.path.join(TEMP_PAGES_ROOT, 'index.html')
+        mtime = os.stat(index).st_mtime_ns
+        self.post.comments.create(author=self.author, text='Комментарий')
+        self.assertEqual(os.stat(index).st_mtime_ns, mtime)
+
+    def test_group_changes(self):
+        group = Group.objects.create(
+            title='Новая группа', slug='new-slug', description='Описание'
+        )
+        self.assertIn('Новая группа', self.page('group', 'new-slug'))
+        group.delete()
+        self.assertFalse(os.path.exists(
+            os.path.join(TEMP_PAGES_ROOT, 'group', 'new-slug', 'index.html')
+        ))
@@ -0,0 +1,124 @@
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from sorl.thumbnail import default
+
+from posts import thumbnails
+from posts.kvstore import KVStore
+from posts.models import Post
+from posts.templatetags.post_thumbnails import post_thumbnail
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+User = get_user_model()
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailsTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.small_gif = (
+            b'\x47\x49\x46\x38\x39\x61\x02\x00'
+            b'\x01\x00\x80\x00\x00\x00\x00\x00'
+            b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+            b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+            b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+            b'\x0A\x00\x3B'
+        )
+        cls.user = User.objects.create_user(username='user')
+        cls.post = Post.objects.create(
+            text='Тестовый текст',
+            image=SimpleUploadedFile(
+                name='small.gif',
+                content=cls.small_gif,
+                content_type='image/gif'
+            ),
+            author=cls.user,
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.guest_client = Client()
+        cache.clear()
+        default.kvstore.clear()
+
+    def test_feed_shows_placeholder_until_ready(self):
+        response = self.guest_client.get(reverse('posts:index'))
+        self.assertContains(response, 'thumbnail-placeholder')
+        self.assertIsNone(thumbnails.get_ready(self.post.image))
+        thumbnails.generate(self.post.pk)
+        thumbnail = thumbnails.get_ready(self.post.image)
+        self.assertIsNotNone(thumbnail)
+        response = self.guest_client.get(reverse('posts:index'))
+        self.assertNotContains(response, 'thumbnail-placeholder')
+        self.assertContains(response, thumbnail.url)
+
+    @override_settings(THUMBNAIL_WORKERS=0)
+    @mock.patch('django.db.transaction.on_commit', lambda func: func())
+    def test_missing_thumbnail_requeued_once(self):
+        with mock.patch('posts.thumbnails.generate') as generate:
+            for _ in range(2):
+                self.assertIsNone(post_thumbnail(self.post.image))
+        generate.assert_called_once_with(self.post.pk)
+
+    def test_generate_thumbnails_command(self):
+        out = StringIO()
+        call_command('generate_thumbnails', stdout=out)
+        self.assertIn('Созданы миниатюры постов: 1', out.getvalue())
+        self.assertIsNotNone(thumbnails.get_ready(self.post.image))
+        out = StringIO()
+        call_command('generate_thumbnails', stdout=out)
+        self.assertIn('Созданы миниатюры постов: 0', out.getvalue())
+
+    def test_kvstore_batch_and_lru(self):
+        thumbnails.generate(self.post.pk)
+        geometry, options = thumbnails.GEOMETRIES['card']
+        thumbnail = thumbnails.lookup_backend.get_thumbnail_file(
+            self.post.image, geometry, **options
+        )
+        kvstore = KVStore()
+        cache.clear()
+        with self.assertNumQueries(1):
+            found = kvstore.get_many([thumbnail])
+        self.assertEqual(found[thumbnail.key].name, thumbnail.name)
+        with self.assertNumQueries(0):
+            self.assertIsNotNone(kvstore.get(thumbnail))
+        self.assertEqual(kvstore.stats()['hits'], 1)
+
+    @override_settings(THUMBNAIL_LRU_SIZE=1)
+    def test_kvstore_lru_is_bounded(self):
+        kvstore = KVStore()
+        kvstore._remember('first', 'value')
+        kvstore._remember('second', 'value')
+        self.assertEqual(kvstore.stats()['size'], 1)
+        self.assertIsNone(kvstore._recall('first'))
+
+    def test_kvstore_stats_in_metrics(self):
+        thumbnails.generate(self.post.pk)
+        thumbnails.get_ready(self.post.image)
+        body = self.guest_client.get('/metrics').content.decode()
+        stats = default.kvstore.stats()
+        for field in ('hits', 'misses', 'size'):
+            with self.subTest(field=field):
+                self.assertIn(
+                    f'# TYPE yatube_thumbnail_kvstore_{field} gauge', body
+                )
+                self.assertIn(
+                    f'yatube_thumbnail_kvstore_{field} {stats[field]}\n',
+                    body,
+                )
@@ -1,10 +1,12 @@
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase
+from django.test import Client, TestCase, override_settings
 from django.urls import reverse
 
-from posts.models import Group, Post
+from posts.counters import recount
+from posts.models import Comment, Follow, Group, Post
+from posts.utils import FORWARD, encode_cursor
 
 from yatube.settings import PAGINATOR_CONST
 
@@ -163,3 +165,161 @@ class PaginatorViewsTest(TestCase):
         self.assertEqual(len(
             response.context['page_obj']), (self.count_posts % PAGINATOR_CONST)
         )
+
+    def test_cursor_pages(self):
+        url = reverse('posts:index')
+        response = self.authorized_client.get(url + '?cursor=')
+        first_page = response.context['page_obj']
+        self.assertEqual(len(first_page), PAGINATOR_CONST)
+        self.assertFalse(first_page.has_previous())
+        response = self.authorized_client.get(
+            url + '?cursor=' + first_page.next_cursor
+        )
+        second_page = response.context['page_obj']
+        self.assertEqual(
+            len(second_page), self.count_posts % PAGINATOR_CONST
+        )
+        self.assertFalse(second_page.has_next())
+        response = self.authorized_client.get(
+            url + '?cursor=' + second_page.previous_cursor
+        )
+        self.assertEqual(
+            list(response.context['page_obj']), list(first_page)
+        )
+
+    def test_invalid_cursor_values_give_first_page(self):
+        url = reverse('posts:index')
+        first_page = self.authorized_client.get(
+            url + '?cursor='
+        ).context['page_obj']
+        for values in (['garbage', 1], [None, None], [[], {}], ['x']):
+            with self.subTest(values=values):
+                response = self.authorized_client.get(
+                    url, {'cursor': encode_cursor(FORWARD, values)}
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(
+                    list(response.context['page_obj']), list(first_page)
+                )
+
+    @override_settings(PAGINATOR_CURSOR=True)
+    def test_cursor_mode_keeps_page_links(self):
+        response = self.authorized_client.get(
+            reverse('posts:group', kwargs={'slug': self.group.slug})
+            + '?page=2'
+        )
+        self.assertEqual(response.context['page_obj'].number, 2)
+
+
+class QueryBudgetTests(TestCase):
+    """Число запросов страницы не зависит от числа постов на ней."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='test-title',
+            slug='test-slug',
+            description='test-description',
+        )
+        for number in range(PAGINATOR_CONST + 2):
+            author = User.objects.create_user(
+                username=f'author{number}', first_name=f'Имя{number}'
+            )
+            Follow.objects.create(user=cls.user, author=author)
+            Post.objects.create(
+                text=f'Тестовый текст {number}',
+                author=author,
+                group=cls.group,
+            )
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+        cache.clear()
+
+    def test_feed_query_budgets(self):
+        author = User.objects.get(username='author0')
+        budgets = {
+            reverse('posts:index'): 2,
+            reverse('posts:group', kwargs={'slug': self.group.slug}): 3,
+            reverse('posts:profile', kwargs={'username': author}): 3,
+        }
+        for url, budget in budgets.items():
+            with self.subTest(url=url):
+                # Первый запрос заводит недостающие счётчики.
+                self.client.get(url)
+                cache.clear()
+                with self.assertNumQueries(budget):
+                    self.client.get(url)
+        # Подписки и список популярных авторов читаются из кэша.
+        self.authorized_client.get(reverse('posts:follow_index'))
+        with self.assertNumQueries(4):
+            self.authorized_client.get(reverse('posts:follow_index'))
+
+
+@override_settings(COMMENTS_PER_PAGE=3)
+class CommentPaginationTests(TestCase):
+    """Комментарии выводятся порциями, авторы — одним JOIN."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        author = User.objects.create_user(username='author')
+        cls.post = Post.objects.create(text='Текст', author=author)
+        for number in range(5):
+            Comment.objects.create(
+                post=cls.post,
+                author=User.objects.create_user(username=f'reader{number}'),
+                text=f'Комментарий {number}',
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_first_page_on_post_detail(self):
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        # Первый запрос заводит недостающие счётчики.
+        self.client.get(url)
+        cache.clear()
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        comments = response.context['comments']
+        self.assertEqual(
+            [comment.text for comment in comments],
+            ['Комментарий 0', 'Комментарий 1', 'Комментарий 2'],
+        )
+        self.assertContains(response, 'Комментарии: 5')
+        self.assertContains(response, comments.next_cursor)
+
+    def test_next_pages(self):
+        first = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        )
+        url = reverse('posts:post_comments', kwargs={'post_id': self.post.pk})
+        cursor = first.context['comments'].next_cursor
+        with self.assertNumQueries(2):
+            fragment = self.client.get(url, {'cursor': cursor})
+        self.assertNotContains(fragment, '<html')
+        self.assertContains(fragment, 'Комментарий 4')
+        self.assertNotContains(fragment, 'Комментарий 2')
+        data = self.client.get(url, {'cursor': cursor, 'format': 'json'})
+        data = data.json()
+        self.assertEqual(data['count'], 5)
+        self.assertEqual(
+            [comment['author'] for comment in data['comments']],
+            ['reader3', 'reader4'],
+        )
+        self.assertIsNone(data['next_cursor'])
+
+    def test_comment_count(self):
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 5)
+        Comment.objects.filter(author__username='reader0').get().delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 4)
+        Post.objects.update(comment_count=0)
+        recount()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 4)
@@ -0,0 +1,148 @@
+import logging
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as thumbnail_defaults
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile
+
+from core import background
+
+from . import cache
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+# Все размеры миниатюр, которые выводят шаблоны.
+GEOMETRIES = {
+    'card': ('960x339', {'crop': 'center', 'upscale': True}),
+}
+
+
+class LookupBackend(ThumbnailBackend):
+    """Бэкенд sorl, который ищет готовую миниатюру, не создавая её."""
+
+    def get_thumbnail_file(self, file_, geometry_string, **options):
+        """ImageFile будущей миниатюры: только имя, без обращения к диску."""
+        source = ImageFile(file_)
+        if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(thumbnail_settings, attr)
+            if value != getattr(thumbnail_defaults, attr):
+                options.setdefault(key, value)
+        name = self._get_thumbnail_filename(source, geometry_string, options)
+        return ImageFile(name, default.storage)
+
+    def get_existing_thumbnail(self, file_, geometry_string, **options):
+        return default.kvstore.get(
+            self.get_thumbnail_file(file_, geometry_string, **options)
+        )
+
+
+lookup_backend = LookupBackend()
+
+
+def get_ready(image, name='card'):
+    """Готовая миниатюра или None, если она ещё не сгенерирована."""
+    geometry, options = GEOMETRIES[name]
+    return lookup_backend.get_existing_thumbnail(image, geometry, **options)
+
+
+def get_ready_many(images, name='card'):
+    """Готовые миниатюры нескольких картинок одним обращением.
+
+    Возвращает словарь {картинка: миниатюра или None}.
+    """
+    geometry, options = GEOMETRIES[name]
+    files = {
+        image: lookup_backend.get_thumbnail_file(image, geometry, **options)
+        for image in images if image
+    }
+    found = default.kvstore.get_many(files.values()) if files else {}
+    return {image: found.get(file.key) for image, file in files.items()}
+
+
+def prefetch(posts, name='card'):
+    """Загружает записи о миниатюрах всей страницы одним обращением.
+
+    Последующие get_ready для этих постов обслуживаются из LRU.
+    """
+    get_ready_many([post.image for post in posts], name)
+
+
+def generate(post_id):
+    """Создаёт недостающие миниатюры поста и обновляет его версию.
+
+    Возвращает True, если что-то пришлось создать.
+    """
+    post = Post.objects.only('image').get(pk=post_id)
+    if not post.image:
+        return False
+    missing = [name for name in GEOMETRIES if not get_ready(post.image, name)]
+    if not missing:
+        return False
+    for name in missing:
+        geometry, options = GEOMETRIES[name]
+        get_thumbnail(post.image, geometry, **options)
+    # Карточка и главная закэшированы с заглушкой — сдвигаем версии.
+    Post.objects.filter(pk=post_id).update(updated=timezone.now())
+    cache.bump(cache.INDEX, cache.post_tag(post_id))
+    return True
+
+
+def _retry_key(post_id):
+    return f'thumbnails:queued:{post_id}'
+
+
+def _enqueue(post_id):
+    transaction.on_commit(lambda: background.submit(
+        'thumbnails', 'THUMBNAIL_WORKERS', generate, post_id
+    ))
+
+
+def schedule(post):
+    """Ставит генерацию миниатюр поста в очередь после коммита."""
+    if not post.image:
+        return
+    caches['default'].set(
+        _retry_key(post.pk), 1, settings.THUMBNAIL_RETRY_TIMEOUT
+    )
+    _enqueue(post.pk)
+
+
+def retry(post_id):
+    """Снова ставит в очередь миниатюры, которых не нашлось при выводе.
+
+    Очередь живёт только в памяти процесса: задачи, упавшие или
+    потерянные при перезапуске, и картинки, загруженные до появления
+    миниатюр, догоняются так. Для одного поста — не чаще раза в
+    THUMBNAIL_RETRY_TIMEOUT секунд.
+    """
+    if caches['default'].add(
+        _retry_key(post_id), 1, settings.THUMBNAIL_RETRY_TIMEOUT
+    ):
+        _enqueue(post_id)
+
+
+def backfill():
+    """Создаёт все недостающие миниатюры; возвращает число постов.
+
+    Карточка с заглушкой может долго жить в кэше фрагментов, не
+    вызывая retry, поэтому остаток догоняет manage.py
+    generate_thumbnails.
+    """
+    total = 0
+    post_ids = Post.objects.exclude(image='').values_list('pk', flat=True)
+    for post_id in post_ids.iterator():
+        try:
+            total += generate(post_id)
+        except Exception:
+            logger.exception('Не удалось создать миниатюры поста %s', post_id)
+    return total
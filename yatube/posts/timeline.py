@@ -0,0 +1,204 @@
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from core import background
+
+from . import counters
+from .models import Follow, Post, PulledAuthor, TimelineEntry
+from .utils import MergedFeed, get_feed
+
+# Порядок ленты подписок: id поста (а не записи) делает ключ общим
+# для записей ленты и постов, которые подмешиваются при чтении.
+ORDERING = ('-created', '-post_id')
+
+PULL_AUTHORS_KEY = 'timeline:pull_authors'
+
+
+def pull_authors():
+    """Авторы, чьи посты не раскладываются по лентам, а читаются из базы.
+
+    Список ведёт rebalance: автор попадает в него, набрав
+    FEED_PULL_THRESHOLD подписчиков, и выходит, опустившись ниже
+    FEED_PUSH_THRESHOLD.
+    """
+    def load():
+        return frozenset(
+            PulledAuthor.objects.values_list('author_id', flat=True)
+        )
+
+    return cache.get_or_set(
+        PULL_AUTHORS_KEY, load, settings.FOLLOW_GRAPH_TIMEOUT
+    )
+
+
+def fan_out(post):
+    """Раскладывает новый пост по лентам подписчиков автора."""
+    if post.author_id in pull_authors():
+        return
+    followers = Follow.objects.filter(
+        author_id=post.author_id
+    ).values_list('user_id', flat=True)
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(user_id=user_id, post=post, created=post.created)
+            for user_id in followers
+        ],
+        batch_size=settings.TIMELINE_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def backfill(user_id, author_ids):
+    """Добавляет в ленту читателя посты авторов, на которых он подписался."""
+    author_ids = set(author_ids) - pull_authors()
+    posts = Post.objects.filter(
+        author_id__in=author_ids
+    ).values_list('id', 'created')
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(user_id=user_id, post_id=post_id, created=created)
+            for post_id, created in posts
+        ],
+        batch_size=settings.TIMELINE_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def trim(user_id, author_ids):
+    """Убирает из ленты читателя посты авторов после отписки."""
+    TimelineEntry.objects.filter(
+        user_id=user_id, post__author_id__in=author_ids
+    ).delete()
+
+
+def _push_author(author_id, since=None):
+    """Раскладывает посты автора по лентам подписчиков пачками."""
+    followers = list(Follow.objects.filter(
+        author_id=author_id
+    ).values_list('user_id', flat=True))
+    posts = Post.objects.filter(author_id=author_id)
+    if since is not None:
+        posts = posts.filter(created__gte=since)
+    entries = (
+        TimelineEntry(user_id=user_id, post_id=post_id, created=created)
+        for post_id, created in posts.values_list('id', 'created')
+        for user_id in followers
+    )
+    while True:
+        batch = list(islice(entries, settings.TIMELINE_BATCH_SIZE))
+        if not batch:
+            break
+        TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def _trim_author(author_id):
+    """Убирает посты автора из всех лент пачками."""
+    entries = TimelineEntry.objects.filter(post__author_id=author_id)
+    while True:
+        ids = list(entries.values_list(
+            'pk', flat=True
+        )[:settings.TIMELINE_BATCH_SIZE])
+        if not ids:
+            break
+        TimelineEntry.objects.filter(pk__in=ids).delete()
+
+
+def _wants_pull(count, pulled):
+    if pulled:
+        return count >= settings.FEED_PUSH_THRESHOLD
+    return count >= settings.FEED_PULL_THRESHOLD
+
+
+def move_author(author_id):
+    """Переводит автора в режим, которого требует число подписчиков.
+
+    В чтение автор переходит сразу, а его записи из лент удаляются
+    потом: дубликаты слияние ленты отбрасывает. В раскладку — наоборот:
+    сначала записи создаются, и только затем автор выходит из чтения;
+    посты, написанные за это время, раскладываются вторым проходом.
+    """
+    count = counters.get(counters.FOLLOWERS, author_id)
+    pulled = PulledAuthor.objects.filter(author_id=author_id).exists()
+    pull = _wants_pull(count, pulled)
+    if pull == pulled:
+        return
+    if pull:
+        PulledAuthor.objects.bulk_create(
+            [PulledAuthor(author_id=author_id)], ignore_conflicts=True
+        )
+        cache.delete(PULL_AUTHORS_KEY)
+        _trim_author(author_id)
+        return
+    started = timezone.now()
+    _push_author(author_id)
+    PulledAuthor.objects.filter(author_id=author_id).delete()
+    cache.delete(PULL_AUTHORS_KEY)
+    _push_author(author_id, since=started)
+
+
+def _move(author_id, lock):
+    try:
+        move_author(author_id)
+    finally:
+        cache.delete(lock)
+
+
+def _schedule_move(author_id):
+    lock = f'timeline:move:{author_id}'
+    if not cache.add(lock, 1, settings.TIMELINE_REBALANCE_TIMEOUT):
+        return
+    transaction.on_commit(lambda: background.submit(
+        'timeline', 'TIMELINE_WORKERS', _move, author_id, lock
+    ))
+
+
+def rebalance(author_ids):
+    """Ставит в очередь авторов, которым пора сменить режим ленты.
+
+    Вызывается после изменения счётчиков подписчиков. Массовое удаление
+    и создание записей лент выполняется после коммита в фоновом потоке,
+    а не в запросе подписки.
+    """
+    pulled = pull_authors()
+    followers = counters.get_many([
+        counters.make_key(counters.FOLLOWERS, author_id)
+        for author_id in author_ids
+    ])
+    for author_id, count in zip(author_ids, followers.values()):
+        pulled_now = author_id in pulled
+        if _wants_pull(count, pulled_now) != pulled_now:
+            _schedule_move(author_id)
+
+
+def as_post(row):
+    """Пост из строки ленты: записи ленты или подмешанного поста."""
+    return row.post if isinstance(row, TimelineEntry) else row
+
+
+def get_timeline(user, followees):
+    """Лента подписок пользователя, от новых к старым.
+
+    Разложенные записи ленты сливаются с последними постами популярных
+    авторов из ``followees``, которые читаются напрямую.
+    """
+    entries = TimelineEntry.objects.filter(user=user)
+    pulled = sorted(followees & pull_authors())
+    streams = [get_feed(entries.only('created'), through='post')]
+    for author_id in pulled:
+        streams.append(get_feed(
+            Post.objects.filter(author_id=author_id)
+        ).annotate(post_id=F('id')))
+
+    def count():
+        # Посты подмешанных авторов считаются по счётчикам, а не COUNT(*).
+        return entries.count() + sum(counters.get_many([
+            counters.make_key(counters.AUTHOR_POSTS, author_id)
+            for author_id in pulled
+        ]).values())
+
+    return MergedFeed(streams, ORDERING, count)
@@ -1,11 +1,256 @@
+import base64
+import heapq
+import json
+from functools import reduce
+from itertools import islice
+from operator import or_
+
 from django.conf import settings
-from django.core.paginator import Paginator
+from django.core.exceptions import ValidationError
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+
+# Колонки, которые шаблоны лент читают у поста, его автора и группы.
+FEED_FIELDS = (
+    'text', 'created', 'updated', 'image', 'author', 'group',
+    'author__username', 'author__first_name', 'author__last_name',
+    'group__slug', 'group__title',
+)
+
+# Колонки комментария и его автора для вывода под постом.
+COMMENT_FIELDS = (
+    'text', 'created', 'post', 'author', 'author__username',
+)
+
+FORWARD = 'n'
+BACKWARD = 'p'
+
+
+def get_feed(queryset, through=None):
+    """Готовит queryset ленты к выводу без N+1 запросов.
+
+    Автор и группа подтягиваются одним JOIN, из таблиц выбираются
+    только колонки из FEED_FIELDS. Для записей, ссылающихся на пост
+    (например, ленты подписок), передаётся имя связи в ``through``.
+    """
+    prefix = f'{through}__' if through else ''
+    fields = [prefix + field for field in FEED_FIELDS]
+    if through:
+        fields.append(through)
+    return queryset.select_related(
+        prefix + 'author', prefix + 'group'
+    ).only(*fields)
+
+
+def encode_cursor(direction, values):
+    """Упаковывает позицию в ленте в непрозрачную строку."""
+    values = [
+        value.isoformat() if hasattr(value, 'isoformat') else value
+        for value in values
+    ]
+    raw = json.dumps([direction, values]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor):
+    """Разбирает курсор; для битого или пустого курсора возвращает None."""
+    try:
+        direction, values = json.loads(base64.urlsafe_b64decode(cursor))
+    except (TypeError, ValueError):
+        return None
+    if direction not in (FORWARD, BACKWARD) or not isinstance(values, list):
+        return None
+    return direction, values
+
+
+class MergedFeed:
+    """Несколько упорядоченных лент, слитые в одну k-путевым слиянием.
+
+    Поддерживает ровно то, что нужно пагинаторам: order_by(), filter(),
+    count() и срезы. Для среза [a:b] из каждой ленты читается не больше
+    b строк, строки с одинаковым ключом сортировки выводятся один раз.
+    Если подсчёт строк по лентам дорог, его заменяет функция ``count``.
+    """
+
+    def __init__(self, streams, ordering, count=None):
+        self.ordering = ordering
+        self.keys = [key.lstrip('-') for key in ordering]
+        self.descending = ordering[0].startswith('-')
+        self.streams = [stream.order_by(*ordering) for stream in streams]
+        # По полям модели первой ленты пагинатор разбирает курсор.
+        self.model = self.streams[0].model
+        self._count = count
+
+    def _key(self, row):
+        return tuple(getattr(row, key) for key in self.keys)
+
+    def order_by(self, *ordering):
+        return MergedFeed(self.streams, ordering, self._count)
+
+    def filter(self, *args, **kwargs):
+        return MergedFeed(
+            [stream.filter(*args, **kwargs) for stream in self.streams],
+            self.ordering,
+        )
+
+    def count(self):
+        if self._count is not None:
+            return self._count()
+        return sum(stream.count() for stream in self.streams)
+
+    def _unique(self, rows):
+        previous = None
+        for row in rows:
+            key = self._key(row)
+            if key != previous:
+                yield row
+            previous = key
+
+    def __getitem__(self, index):
+        if len(self.streams) == 1:
+            return list(self.streams[0][index])
+        rows = heapq.merge(
+            *(stream[:index.stop] for stream in self.streams),
+            key=self._key,
+            reverse=self.descending,
+        )
+        return list(islice(self._unique(rows), index.start, index.stop))
+
+
+class CursorPage(Page):
+    """Страница курсорной пагинации: без номера и без подсчёта строк."""
+
+    def __init__(self, object_list, paginator, next_cursor, previous_cursor):
+        super().__init__(object_list, None, paginator)
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return '<Cursor page>'
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+class CursorPaginator:
+    """Keyset-пагинация по упорядоченному набору уникальных ключей.
+
+    Вместо OFFSET и COUNT(*) каждая страница выбирается условием
+    «строго после (или до) ключа крайней записи» и читается одним
+    индексным диапазоном.
+    """
+    is_cursor = True
+
+    def __init__(self, object_list, per_page, ordering=('-created', '-id')):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.ordering = ordering
+        self.keys = [key.lstrip('-') for key in ordering]
+        self.descending = ordering[0].startswith('-')
+
+    def _key(self, obj):
+        return [getattr(obj, key) for key in self.keys]
+
+    def _parse(self, values):
+        """Значения курсора в типах полей ключа; None, если не разобрать."""
+        if len(values) != len(self.keys):
+            return None
+        opts = self.object_list.model._meta
+        try:
+            parsed = [
+                opts.get_field(key).to_python(value)
+                for key, value in zip(self.keys, values)
+            ]
+        except (TypeError, ValueError, ValidationError):
+            return None
+        return None if None in parsed else parsed
+
+    def _after(self, values, descending):
+        lookup = 'lt' if descending else 'gt'
+        conditions = []
+        for index, key in enumerate(self.keys):
+            condition = {
+                f'{prev}__exact': value
+                for prev, value in zip(self.keys[:index], values)
+            }
+            condition[f'{key}__{lookup}'] = values[index]
+            conditions.append(Q(**condition))
+        return reduce(or_, conditions)
+
+    def get_page(self, cursor):
+        position = decode_cursor(cursor) if cursor else None
+        if position:
+            # Подделанный курсор — первая страница, а не ошибка 500.
+            values = self._parse(position[1])
+            position = None if values is None else (position[0], values)
+        backward = position is not None and position[0] == BACKWARD
+        descending = self.descending != backward
+        queryset = self.object_list.order_by(*(
+            f'-{key}' if descending else key for key in self.keys
+        ))
+        if position:
+            queryset = queryset.filter(self._after(position[1], descending))
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backward:
+            rows.reverse()
+        next_cursor = previous_cursor = None
+        if rows:
+            if backward or has_more:
+                next_cursor = encode_cursor(FORWARD, self._key(rows[-1]))
+            if (backward and has_more) or (not backward and position):
+                previous_cursor = encode_cursor(
+                    BACKWARD, self._key(rows[0])
+                )
+        return CursorPage(rows, self, next_cursor, previous_cursor)
+
+
+def get_comments_page(post, cursor):
+    """Страница комментариев поста, от старых к новым.
+
+    Авторы подтягиваются одним JOIN, страница читается диапазоном
+    индекса (post, created) после курсора.
+    """
+    comments = post.comments.select_related('author').only(*COMMENT_FIELDS)
+    paginator = CursorPaginator(
+        comments, settings.COMMENTS_PER_PAGE, ordering=('created', 'id')
+    )
+    return paginator.get_page(cursor)
+
+
+class CountedPaginator(Paginator):
+    """Paginator, которому общее число записей передаётся готовым."""
+
+    def __init__(self, object_list, per_page, count=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        if count is not None:
+            self.count = count
 
 
-def get_page_context(queryset, request):
-    paginator = Paginator(queryset, settings.PAGINATOR_CONST)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+def get_page_context(queryset, request, count=None, allow_cursor=True,
+                     ordering=('-created', '-id')):
+    cursor = request.GET.get('cursor')
+    use_cursor = allow_cursor and (cursor is not None or (
+        settings.PAGINATOR_CURSOR and 'page' not in request.GET
+    ))
+    if use_cursor:
+        paginator = CursorPaginator(
+            queryset, settings.PAGINATOR_CONST, ordering
+        )
+        page_obj = paginator.get_page(cursor)
+    else:
+        paginator = CountedPaginator(
+            queryset, settings.PAGINATOR_CONST, count=count
+        )
+        page_obj = paginator.get_page(request.GET.get('page'))
+    query = request.GET.copy()
+    query.pop('page', None)
+    query.pop('cursor', None)
     return {
         'page_obj': page_obj,
+        'page_query': query.urlencode() + '&' if query else '',
     }
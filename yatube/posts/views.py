@@ -1,19 +1,38 @@
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import get_object_or_404, redirect, render
-from django.http import HttpResponseRedirect
-from django.views.decorators.cache import cache_page
-
+from django.http import HttpResponseRedirect, JsonResponse
+
+from . import counters, follow_graph, thumbnails, timeline
+from .search import search_posts
+from .cache import (
+    COMMENTS, FOLLOWS, INDEX, POSTS, author_tag, cache_anonymous_page,
+    cache_page_versioned, comments_tag, conditional, group_tag, post_tag, tag,
+    tag_posts,
+)
 from .forms import PostForm, CommentForm
-from .models import Group, Post, User, Follow
-from .utils import get_page_context
+from .models import Group, Post, User
+from .utils import get_comments_page, get_feed, get_page_context
 
 
-@cache_page(1 * 20)
+@conditional(INDEX)
+@cache_anonymous_page(settings.ANONYMOUS_PAGE_CACHE_TIMEOUT)
+@cache_page_versioned(settings.INDEX_CACHE_TIMEOUT, INDEX)
 def index(request):
-    context = get_page_context(Post.objects.all(), request)
+    context = get_page_context(
+        get_feed(Post.objects.all()),
+        request,
+        counters.get(counters.ALL_POSTS),
+    )
+    tag(request, POSTS)
+    tag_posts(request, context['page_obj'])
+    thumbnails.prefetch(context['page_obj'])
     return render(request, 'posts/index.html', context)
 
 
+@conditional(INDEX)
+@cache_anonymous_page(settings.ANONYMOUS_PAGE_CACHE_TIMEOUT)
+@cache_page_versioned(settings.INDEX_CACHE_TIMEOUT, INDEX)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
     posts = group.posts.all()
@@ -21,39 +40,110 @@ def group_posts(request, slug):
         'group': group,
         'posts': posts,
     }
-    context.update(get_page_context(group.posts.all(), request))
+    context.update(get_page_context(
+        get_feed(group.posts.all()),
+        request,
+        counters.get(counters.GROUP_POSTS, group.pk),
+    ))
+    tag(request, group_tag(group.slug))
+    tag_posts(request, context['page_obj'])
+    thumbnails.prefetch(context['page_obj'])
     return render(request, 'posts/group_list.html', context)
 
 
+@conditional(INDEX, FOLLOWS)
+@cache_anonymous_page(settings.ANONYMOUS_PAGE_CACHE_TIMEOUT)
 def profile(request, username):
     author = get_object_or_404(User, username=username)
     user = request.user
-    following = user.is_authenticated and author.following.exists()
-    post_count = author.posts.count()
+    following = (
+        user.is_authenticated
+        and follow_graph.is_following(user.pk, author.pk)
+    )
+    totals = counters.get_many([
+        counters.make_key(counters.AUTHOR_POSTS, author.pk),
+        counters.make_key(counters.FOLLOWERS, author.pk),
+        counters.make_key(counters.FOLLOWING, author.pk),
+    ])
+    post_count, followers_count, following_count = totals.values()
     context = {
         'author': author,
         'post_count': post_count,
+        'followers_count': followers_count,
+        'following_count': following_count,
         'following': following,
     }
-    context.update(get_page_context(author.posts.all(), request))
+    context.update(
+        get_page_context(get_feed(author.posts.all()), request, post_count)
+    )
+    tag(request, author_tag(author.username))
+    tag_posts(request, context['page_obj'])
+    thumbnails.prefetch(context['page_obj'])
     return render(request, 'posts/profile.html', context)
 
 
+@conditional(INDEX, COMMENTS)
+@cache_anonymous_page(settings.ANONYMOUS_PAGE_CACHE_TIMEOUT)
 def post_detail(request, post_id):
     form = CommentForm()
-    posts = get_object_or_404(Post, pk=post_id)
+    posts = get_object_or_404(
+        Post.objects.select_related('author', 'group'), pk=post_id
+    )
     author = posts.author
-    posts_count = author.posts.count()
-    comments = posts.comments.all()
+    posts_count = counters.get(counters.AUTHOR_POSTS, author.pk)
+    comments = get_comments_page(posts, request.GET.get('cursor'))
     context = {
         'posts': posts,
         'posts_count': posts_count,
         'form': form,
         'comments': comments,
     }
+    tag(request, comments_tag(posts.pk))
+    tag_posts(request, [posts])
     return render(request, 'posts/post_detail.html', context)
 
 
+@conditional(INDEX, COMMENTS)
+@cache_anonymous_page(settings.ANONYMOUS_PAGE_CACHE_TIMEOUT)
+def post_comments(request, post_id):
+    """Следующая порция комментариев: HTML-фрагмент или JSON."""
+    post = get_object_or_404(Post.objects.only('comment_count'), pk=post_id)
+    comments = get_comments_page(post, request.GET.get('cursor'))
+    tag(request, post_tag(post.pk), comments_tag(post.pk))
+    if request.GET.get('format') != 'json':
+        return render(request, 'posts/includes/comments.html', {
+            'posts': post,
+            'comments': comments,
+        })
+    return JsonResponse({
+        'count': post.comment_count,
+        'comments': [
+            {
+                'id': comment.pk,
+                'author': comment.author.username,
+                'text': comment.text,
+                'created': comment.created,
+            }
+            for comment in comments
+        ],
+        'next_cursor': comments.next_cursor,
+    })
+
+
+@cache_anonymous_page(settings.ANONYMOUS_PAGE_CACHE_TIMEOUT)
+def search(request):
+    query = request.GET.get('q', '').strip()
+    context = {'query': query}
+    context.update(get_page_context(
+        get_feed(search_posts(query)), request, allow_cursor=False
+    ))
+    # Правка любого поста может изменить выдачу поиска.
+    tag(request, INDEX)
+    tag_posts(request, context['page_obj'])
+    thumbnails.prefetch(context['page_obj'])
+    return render(request, 'posts/search.html', context)
+
+
 @login_required
 def add_comment(request, post_id):
     form = CommentForm(request.POST or None)
@@ -76,6 +166,7 @@ def post_create(request):
         post = form.save(commit=False)
         post.author = request.user
         post.save()
+        thumbnails.schedule(post)
         return redirect('posts:profile', username=request.user)
     return render(request, 'posts/create_post.html', {'form': form})
 
@@ -88,6 +179,7 @@ def post_edit(request, post_id):
     form = PostForm(request.POST or None, instance=post)
     if form.is_valid():
         form.save()
+        thumbnails.schedule(post)
         return redirect('posts:post_detail', str(post_id))
     context = {
         'form': form,
@@ -99,33 +191,33 @@ def post_edit(request, post_id):
 
 @login_required
 def follow_index(request):
-    post_list = Post.objects.filter(
-        author__following__user=request.user
+    user = request.user
+    context = get_page_context(
+        timeline.get_timeline(user, follow_graph.get_followees(user.pk)),
+        request,
+        ordering=timeline.ORDERING,
     )
-    context = get_page_context(post_list, request)
+    page_obj = context['page_obj']
+    page_obj.object_list = [timeline.as_post(row) for row in page_obj]
+    thumbnails.prefetch(page_obj)
     return render(request, 'posts/follow.html', context)
 
 
 @login_required
 def profile_follow(request, username):
-    author = User.objects.filter(username=username).first()
+    author = get_object_or_404(User, username=username)
     user = request.user
-    if author != user:
-        follow = Follow.objects.filter(user=user, author=author).first()
-        if not follow:
-            Follow.objects.get_or_create(user=user, author=author)
-            return redirect(
-                'posts:profile',
-                username=username
-            )
+    if author != user and follow_graph.follow(user.pk, author.pk):
+        return redirect(
+            'posts:profile',
+            username=username
+        )
     return HttpResponseRedirect(request.META.get('HTTP_REFERER'))
 
 
 @login_required
 def profile_unfollow(request, username):
-    author = User.objects.filter(username=username).first()
+    author = get_object_or_404(User, username=username)
     user = request.user
-    follow = Follow.objects.filter(user=user, author=author).first()
-    if follow:
-        follow.delete()
+    follow_graph.unfollow(user.pk, author.pk)
     return HttpResponseRedirect(request.META.get('HTTP_REFERER'))
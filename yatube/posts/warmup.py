@@ -0,0 +1,92 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count
+from django.urls import reverse
+
+from . import counters, rendering
+from .models import Group, User
+
+logger = logging.getLogger(__name__)
+
+
+def get_urls(pages, profiles):
+    """Страницы для прогрева: главная, группы и популярные профили.
+
+    Группы идут по убыванию числа постов, профили — по числу
+    подписчиков, чтобы при нехватке времени прогрелось самое нужное.
+    """
+    def paged(url):
+        return [url] + [f'{url}?page={page}' for page in range(2, pages + 1)]
+
+    urls = paged(reverse('posts:index'))
+    groups = Group.objects.annotate(
+        total=Count('posts')
+    ).order_by('-total').values_list('slug', flat=True)
+    for slug in groups:
+        urls += paged(reverse('posts:group', kwargs={'slug': slug}))
+    author_ids = counters.top(counters.FOLLOWERS, profiles)
+    usernames = dict(User.objects.filter(
+        pk__in=author_ids
+    ).values_list('pk', 'username'))
+    for author_id in author_ids:
+        if author_id in usernames:
+            urls += paged(reverse(
+                'posts:profile', kwargs={'username': usernames[author_id]}
+            ))
+    return urls
+
+
+def warm(urls, workers, budget):
+    """Рендерит страницы анонимно в несколько потоков.
+
+    View вызывается напрямую, без middleware (см. rendering). Что
+    не успело начаться за budget секунд, пропускается. Возвращает
+    число страниц, отданных с кодом 200.
+    """
+    deadline = time.monotonic() + budget
+
+    def fetch(url):
+        if time.monotonic() >= deadline:
+            return None
+        try:
+            return rendering.render(url).status_code
+        except Exception:
+            logger.exception('Не удалось прогреть %s', url)
+            return None
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(fetch, url) for url in urls]
+        done, pending = wait(
+            futures, timeout=max(deadline - time.monotonic(), 0)
+        )
+        for future in pending:
+            future.cancel()
+    return sum(1 for future in done if future.result() == 200)
+
+
+def warm_in_background():
+    """Прогревает кэш по настройкам WARM_CACHE_* в фоновом потоке."""
+    def run():
+        try:
+            urls = get_urls(
+                settings.WARM_CACHE_PAGES, settings.WARM_CACHE_PROFILES
+            )
+            warmed = warm(
+                urls, settings.WARM_CACHE_WORKERS, settings.WARM_CACHE_BUDGET
+            )
+            logger.info('Прогрето страниц: %s из %s', warmed, len(urls))
+        except Exception:
+            logger.exception('Прогрев кэша не удался')
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=run, name='warm-cache', daemon=True)
+    thread.start()
+    return thread
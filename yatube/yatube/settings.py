@@ -29,6 +29,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
+    'core.middleware.SlowQueryMiddleware',
+    'core.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -45,7 +48,7 @@ TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'core.template_backends.TimedDjangoTemplates',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -54,7 +57,8 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
-                'core.context_processors.year.year'
+                'core.context_processors.year.year',
+                'core.context_processors.cache_timeouts.cache_timeouts',
             ],
         },
     },
@@ -66,9 +70,33 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+    },
+    # Реплика только для чтения: копия SQLite-файла (например, через
+    # `sqlite3 db.sqlite3 ".backup replica.sqlite3"`). В тестах это
+    # зеркало default.
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'replica.sqlite3'),
+        'TEST': {'MIRROR': 'default'},
+    },
 }
 
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+
+# Алиасы реплик для чтения; пустой список — всё читается из default.
+DATABASE_REPLICAS = []
+
+REPLICA_VIEWS = [
+    'posts:index',
+    'posts:group',
+    'posts:profile',
+    'posts:post_detail',
+    'posts:follow_index',
+    'posts:search',
+]
+
+REPLICA_PIN_SECONDS = 10
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -108,11 +136,143 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
 PAGINATOR_CONST = 10
 
+# Комментариев на странице поста и в каждой догружаемой порции.
+COMMENTS_PER_PAGE = 20
+
+# JSON API лент: наибольший limit страницы и размер пачки, которой
+# лента читается при потоковой выгрузке (?export).
+API_MAX_LIMIT = 100
+API_EXPORT_BATCH_SIZE = 500
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+INDEX_CACHE_TIMEOUT = 60 * 60
+
+POST_CARD_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Страницы для анонимов сбрасываются по суррогатным ключам, поэтому
+# срок жизни может быть большим.
+ANONYMOUS_PAGE_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Каталог статических копий главной и страниц групп для анонимов
+# (manage.py publish_pages). Фронтовый сервер отдаёт <адрес>/index.html
+# сам на запросы без cookie сессии и строки запроса. None — выключено.
+STATIC_PAGES_ROOT = os.environ.get('YATUBE_STATIC_PAGES')
+
+# Потоки перерисовки статических копий; 0 — сразу после коммита.
+STATIC_PAGES_WORKERS = 1
+
+# Режим stale-while-revalidate: устаревшая копия страницы моложе этого
+# срока отдаётся сразу, пока свежая считается в фоне (0 — выключен).
+# При ошибке базы годится копия не старше PAGE_CACHE_STALE_IF_ERROR.
+PAGE_CACHE_STALE_WHILE_REVALIDATE = 0
+PAGE_CACHE_STALE_IF_ERROR = 60 * 60 * 24
+# Потоки фонового обновления страниц; 0 — обновлять в самом запросе.
+PAGE_CACHE_REFRESH_WORKERS = 2
+PAGE_CACHE_REFRESH_TIMEOUT = 30
+
+# Потоки фоновой генерации миниатюр; 0 — генерировать сразу после коммита.
+THUMBNAIL_WORKERS = 2
+# Не чаще этого срока (в секундах) миниатюры поста, не найденные при
+# выводе, снова ставятся в очередь.
+THUMBNAIL_RETRY_TIMEOUT = 60 * 5
+
+THUMBNAIL_KVSTORE = 'posts.kvstore.KVStore'
+
+THUMBNAIL_LRU_SIZE = 1000
+
+# default — двухуровневый кэш: L1 в памяти процесса перед общим
+# для воркеров кэшем shared.
 CACHES = {
     'default': {
+        'BACKEND': 'core.cache_backends.TieredCache',
+        'OPTIONS': {
+            'L2': 'shared',
+            'L1_TIMEOUT': 1,
+            'L1_MAX_ENTRIES': 1000,
+            'LOCK_TIMEOUT': 10,
+        },
+    },
+    'shared': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shared',
+    },
+}
+
+# Файл общего кэша для воркеров одного хоста (например, в /dev/shm).
+# Без него (разработка, тесты) shared живёт в памяти процесса.
+SHARED_CACHE_PATH = os.environ.get('YATUBE_SHARED_CACHE')
+
+if SHARED_CACHE_PATH:
+    CACHES['shared'] = {
+        'BACKEND': 'core.cache_backends.MmapCache',
+        'LOCATION': SHARED_CACHE_PATH,
+        'OPTIONS': {
+            'SLOTS': 1024,
+            'WAYS': 8,
+            'SLOT_SIZE': 64 * 1024,
+        },
     }
+
+TIMELINE_BATCH_SIZE = 500
+
+# Сколько живёт закэшированное множество подписок пользователя.
+FOLLOW_GRAPH_TIMEOUT = 24 * 60 * 60
+
+# Размер пачки для массовой подписки и отписки.
+FOLLOW_BATCH_SIZE = 500
+
+# С этого числа подписчиков посты автора не раскладываются по лентам
+# подписчиков, а подмешиваются в ленту при чтении. Обратно в раскладку
+# автор возвращается, только опустившись ниже FEED_PUSH_THRESHOLD:
+# зазор не даёт ему переключаться на каждой подписке и отписке.
+FEED_PULL_THRESHOLD = 10000
+FEED_PUSH_THRESHOLD = 8000
+
+# Потоки фонового перевода авторов между раскладкой и чтением;
+# 0 — выполнять сразу после коммита.
+TIMELINE_WORKERS = 1
+TIMELINE_REBALANCE_TIMEOUT = 60 * 60
+
+# Прогрев кэша (manage.py warm_cache и YATUBE_WARM_CACHE в wsgi.py):
+# сколько страниц лент и самых популярных профилей запросить, в сколько
+# потоков и за сколько секунд.
+WARM_CACHE_PAGES = 3
+WARM_CACHE_PROFILES = 20
+WARM_CACHE_WORKERS = 4
+WARM_CACHE_BUDGET = 30
+
+# Курсорная (keyset) пагинация лент вместо OFFSET-страниц.
+# Ссылки вида ?page=N продолжают работать при любом значении.
+PAGINATOR_CURSOR = False
+
+# Порог в секундах для журнала медленных запросов; None — выключен.
+SLOW_QUERY_THRESHOLD = 0.1
+
+SLOW_QUERY_LOG = os.path.join(BASE_DIR, 'slow_queries.log')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'slow_queries': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': SLOW_QUERY_LOG,
+            'maxBytes': 5 * 1024 * 1024,
+            'backupCount': 3,
+            'formatter': 'message',
+            'delay': True,
+        },
+    },
+    'loggers': {
+        'yatube.slow_queries': {
+            'handlers': ['slow_queries'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
 }
@@ -5,3 +5,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
 
 application = get_wsgi_application()
+
+# Прогрев кэша в фоне после старта воркера, см. WARM_CACHE_* в settings.
+if os.environ.get('YATUBE_WARM_CACHE'):
+    from posts.warmup import warm_in_background
+
+    warm_in_background()